@@ -0,0 +1,246 @@
+import os
+import io
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+import tempfile
+import subprocess
+import numpy as np
+from PIL import Image
+
+import jax
+import main
+import model
+import serving
+from main import logger
+
+# ------------------------------
+# Helpers
+# ------------------------------
+def _percentiles(samples_ms):
+    samples = np.asarray(samples_ms)
+    return {
+        'p50_ms': float(np.percentile(samples, 50)),
+        'p95_ms': float(np.percentile(samples, 95)),
+        'p99_ms': float(np.percentile(samples, 99)),
+        'mean_ms': float(np.mean(samples)),
+    }
+
+def _jpeg(rng, size=256):
+    # Smooth random blobs rather than white noise, so JPEG sizes resemble real photos.
+    base = rng.randint(0, 255, (8, 8, 3), dtype=np.uint8)
+    image = Image.fromarray(base).resize((size, size), Image.BILINEAR)
+    buf = io.BytesIO()
+    image.save(buf, "JPEG", quality=90)
+    return buf.getvalue()
+
+def make_synthetic_dataset(root, num_classes=4, images_per_class=64, size=256, seed=0):
+    """Write ``root/<class>/<n>.jpg`` with random images."""
+    rng = np.random.RandomState(seed)
+    for c in range(num_classes):
+        class_dir = os.path.join(root, f"class_{c}")
+        os.makedirs(class_dir, exist_ok=True)
+        for i in range(images_per_class):
+            with open(os.path.join(class_dir, f"{i}.jpg"), "wb") as f:
+                f.write(_jpeg(rng, size))
+    return root
+
+# ------------------------------
+# Benchmarks
+# ------------------------------
+_IMPORT_PROBE = """
+import json, resource, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+try:
+    # ru_maxrss can carry over the parent's peak across fork/exec on Linux; VmHWM cannot.
+    with open("/proc/self/status") as f:
+        rss_mb = next(int(line.split()[1]) for line in f if line.startswith("VmHWM")) / 2**10
+except OSError:
+    rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (2**20 if sys.platform == 'darwin' else 2**10)
+print(json.dumps({{'import_s': elapsed, 'max_rss_mb': rss_mb,
+                  'heavy_modules': sorted(m for m in {heavy!r} if m in sys.modules)}}))
+"""
+HEAVY_MODULES = ('tensorflow', 'optax', 'tqdm', 'IPython', 'fastapi')
+
+def bench_imports(modules=("model", "serving", "main"), repeats=3):
+    """Cold import time and peak RSS of each module in a fresh interpreter (fastest of ``repeats``)."""
+    src_dir = os.path.dirname(os.path.abspath(__file__))
+    results = {}
+    for module in modules:
+        probe = _IMPORT_PROBE.format(module=module, heavy=HEAVY_MODULES)
+        runs = []
+        for _ in range(repeats):
+            out = subprocess.run([sys.executable, "-c", probe], cwd=src_dir, capture_output=True,
+                                 text=True, check=True).stdout
+            runs.append(json.loads(out.strip().splitlines()[-1]))
+        results[module] = min(runs, key=lambda run: run['import_s'])
+    return results
+
+def bench_loader(data_dir, img_size, batch_size, epochs=2):
+    """Images/sec through TurboDataLoader; epoch 0 includes decode and cache fill."""
+    loader = main.TurboDataLoader(data_dir, img_size, batch_size, augment=True)
+    loader.load()
+    results = []
+    for epoch in range(epochs):
+        start = time.perf_counter()
+        count = sum(len(labels) for _, labels in loader.train_dataset(epoch).as_numpy_iterator())
+        elapsed = time.perf_counter() - start
+        results.append({'epoch': epoch, 'images': count, 'images_per_sec': count / elapsed})
+    return results
+
+def bench_train_eval(num_classes, img_size, batch_size, steps=20):
+    """First-call (compile) time and steady-state steps/sec of train_step and eval_step."""
+    trainer = main.SpeedTrainer(num_classes=num_classes)
+    state = trainer.create_state(jax.random.PRNGKey(0), input_shape=(1, img_size, img_size, 3))
+    rng = np.random.RandomState(0)
+    batch = (rng.rand(batch_size, img_size, img_size, 3).astype(np.float32),
+             rng.randint(0, num_classes, batch_size).astype(np.int32))
+    dropout_rng = jax.random.PRNGKey(1)
+
+    start = time.perf_counter()
+    state, metrics = trainer.train_step(state, batch, dropout_rng)
+    jax.block_until_ready(metrics)
+    train_compile = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(steps):
+        state, metrics = trainer.train_step(state, batch, dropout_rng)
+    jax.block_until_ready(metrics)
+    train_steady = (time.perf_counter() - start) / steps
+
+    start = time.perf_counter()
+    jax.block_until_ready(trainer.eval_step(state, batch))
+    eval_compile = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(steps):
+        metrics = trainer.eval_step(state, batch)
+    jax.block_until_ready(metrics)
+    eval_steady = (time.perf_counter() - start) / steps
+
+    results = {
+        'batch_size': batch_size,
+        'train_step': {'first_call_s': train_compile, 'steps_per_sec': 1 / train_steady,
+                       'images_per_sec': batch_size / train_steady},
+        'eval_step': {'first_call_s': eval_compile, 'steps_per_sec': 1 / eval_steady,
+                      'images_per_sec': batch_size / eval_steady},
+    }
+    return state, results
+
+def bench_inference(model_path, batch_sizes=(1, 2, 4, 8, 16, 32, 64), repeats=20):
+    """ModelInference.predict_batch latency per batch size (after warmup)."""
+    inference = model.load_inference_artifact(model_path)
+    start = time.perf_counter()
+    inference.warmup()
+    results = {'warmup_s': time.perf_counter() - start, 'batch_sizes': {}}
+    rng = np.random.RandomState(0)
+    for batch_size in batch_sizes:
+        images = rng.rand(batch_size, inference.img_size, inference.img_size, 3).astype(np.float32)
+        inference.predict_batch(images)
+        samples = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            inference.predict_batch(images)
+            samples.append((time.perf_counter() - start) * 1000)
+        stats = _percentiles(samples)
+        stats['images_per_sec'] = batch_size / (stats['mean_ms'] / 1000)
+        results['batch_sizes'][str(batch_size)] = stats
+    return results
+
+async def _bench_predict_endpoint(model_path, requests, concurrency):
+    import httpx
+    serving.MODEL_PATH = model_path
+    await serving.load_model()
+    try:
+        payloads = [_jpeg(np.random.RandomState(i)) for i in range(min(requests, 64))]
+        transport = httpx.ASGITransport(app=serving.app)
+        latencies, errors = [], 0
+        queue = asyncio.Queue()
+        for i in range(requests):
+            queue.put_nowait(payloads[i % len(payloads)])
+
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            async def worker():
+                nonlocal errors
+                while not queue.empty():
+                    payload = queue.get_nowait()
+                    start = time.perf_counter()
+                    response = await client.post("/predict/", files={"file": ("leaf.jpg", payload, "image/jpeg")})
+                    latencies.append((time.perf_counter() - start) * 1000)
+                    if response.status_code != 200:
+                        errors += 1
+
+            start = time.perf_counter()
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+            elapsed = time.perf_counter() - start
+    finally:
+        await serving.stop_batcher()
+    results = _percentiles(latencies)
+    results.update({'requests': requests, 'concurrency': concurrency, 'errors': errors,
+                    'requests_per_sec': requests / elapsed})
+    return results
+
+def bench_predict_endpoint(model_path, requests=200, concurrency=16):
+    """End-to-end /predict/ throughput and latency through an in-process ASGI client."""
+    return asyncio.run(_bench_predict_endpoint(model_path, requests, concurrency))
+
+# ------------------------------
+# Main Execution
+# ------------------------------
+def run(args):
+    report = {
+        'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'jax': jax.__version__,
+            'backend': jax.default_backend(),
+            'devices': [str(d) for d in jax.devices()],
+        },
+        'config': vars(args),
+    }
+    if "imports" not in args.skip:
+        logger.info("Measuring import time and memory...")
+        report['imports'] = bench_imports()
+    with tempfile.TemporaryDirectory() as tmp:
+        data_dir = make_synthetic_dataset(os.path.join(tmp, "dataset"), args.classes,
+                                          args.images_per_class, seed=args.seed)
+        if "loader" not in args.skip:
+            logger.info("Benchmarking TurboDataLoader...")
+            report['loader'] = bench_loader(data_dir, args.img_size, args.batch_size)
+        logger.info("Benchmarking train_step / eval_step...")
+        state, report['trainer'] = bench_train_eval(args.classes, args.img_size, args.batch_size,
+                                                    steps=args.train_steps)
+        model_path = os.path.join(tmp, "model.flax")
+        model.export_inference_artifact(model_path, state, [f"class_{c}" for c in range(args.classes)],
+                                       img_size=args.img_size)
+        if "inference" not in args.skip:
+            logger.info("Benchmarking ModelInference...")
+            report['inference'] = bench_inference(model_path)
+        if "endpoint" not in args.skip:
+            logger.info("Benchmarking /predict/...")
+            report['endpoint'] = bench_predict_endpoint(model_path, args.requests, args.concurrency)
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the training and serving hot paths on synthetic data")
+    parser.add_argument("--output", default="benchmark_results.json", help="Where to write the JSON report")
+    parser.add_argument("--classes", type=int, default=4)
+    parser.add_argument("--images-per-class", type=int, default=64)
+    parser.add_argument("--img-size", type=int, default=128)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--train-steps", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--skip", nargs="*", default=[], choices=["imports", "loader", "inference", "endpoint"])
+    args = parser.parse_args()
+    report = run(args)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+    logger.info(f"Benchmark report written to {args.output}")
@@ -1,8 +1,14 @@
 import os
+import json
+import argparse
 import time
+import hashlib
+import shutil
 import logging
 import functools
+import collections
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from tqdm.notebook import tqdm
 from IPython.display import clear_output # type: ignore
@@ -24,27 +30,34 @@ except ImportError:
 # Import JAX and related libraries
 import jax
 import jax.numpy as jnp
-import flax.linen as nn
-from flax.training import train_state, checkpoints
+from flax.training import train_state
 from flax import struct  # for custom TrainState
+from flax import serialization
 import optax
 import tensorflow as tf
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
+# TensorFlow/absl install a root handler at WARNING before basicConfig runs, which would
+# otherwise swallow this module's progress messages.
+logger.setLevel(logging.INFO)
 
-from fastapi import FastAPI, File, UploadFile, HTTPException
-from fastapi.middleware.cors import CORSMiddleware
-from PIL import Image
-import io
-from typing import List
+# Inference-side code shared with the API server (serving.py), which never imports this module.
+from model import (BATCH_BUCKETS, DATA_PATH, IMAGE_EXTENSIONS, PROJECT_ROOT, FastVisionModel, _atomic_write,
+                   as_float_images, compilation_cache_stats, decode_image, enable_compilation_cache,
+                   export_inference_artifact, load_parity_baseline, precision_parity, quantize_artifact, score_images)
 
 # ... (Your existing Python code: setup_hardware, TrainStateWithBN, TurboDataLoader, FastVisionModel, SpeedTrainer, TrainingProgress, TurboPipeline, ModelInference) ...
 # ... (Copy all your existing code here) ...
 
-def setup_hardware():
-    gpu_devices = jax.devices('gpu')
+def setup_hardware(num_cpu_devices=None):
+    if num_cpu_devices:
+        # Split the host CPU into several XLA devices (for data-parallel runs without GPUs).
+        # Only takes effect if no JAX backend has been initialized yet in this process.
+        os.environ["XLA_FLAGS"] = (os.environ.get("XLA_FLAGS", "") +
+                                   f" --xla_force_host_platform_device_count={num_cpu_devices}").strip()
+    gpu_devices = [d for d in jax.devices() if d.platform == 'gpu']
     if gpu_devices:
         logger.info(f"Found {len(gpu_devices)} GPU device(s): {gpu_devices}")
         # Let JAX handle GPU; TF is only used for data loading.
@@ -52,7 +65,6 @@ def setup_hardware():
     else:
         logger.warning("No GPU detected. Performance may be limited.")
 
-    jax.config.update("jax_enable_x64", True)
     jax.config.update("jax_default_matmul_precision", "default")
     devices_info = jax.devices()
     logger.info(f"JAX using devices: {devices_info}")
@@ -69,12 +81,27 @@ class TrainStateWithBN(train_state.TrainState):
 # Optimized Dataset Pipeline
 # ------------------------------
 class TurboDataLoader:
-    def __init__(self, data_dir, img_size=128, batch_size=64, val_split=0.2, augment=True):
+    """tf.data pipeline: decode -> uint8 cache -> shuffle -> batch -> seeded augment -> prefetch."""
+    def __init__(self, data_dir, img_size=128, batch_size=64, val_split=0.2, augment=True,
+                 cache_file=None, seed=42, shuffle_buffer=2048, shard_dir=None):
         self.data_dir = Path(data_dir)
         self.img_size = img_size
         self.batch_size = batch_size
         self.val_split = val_split
         self.augment = augment
+        self.cache_file = cache_file
+        self.seed = seed
+        self.shuffle_buffer = shuffle_buffer
+        self.shard_dir = Path(shard_dir) if shard_dir else None
+        self._cached = {}
+        self._shards = None
+
+        if self.shard_dir is not None:
+            # Shard mode: everything comes from the ingested index, the image tree is never listed.
+            if not (self.shard_dir / SHARD_INDEX).exists():
+                raise FileNotFoundError(f"No ingested shards at {self.shard_dir}; run `main.py ingest` first")
+            logger.info(f"Loading dataset shards from: {self.shard_dir}")
+            return
 
         if not self.data_dir.exists():
             raise FileNotFoundError(f"Dataset not found: {self.data_dir}")
@@ -89,101 +116,391 @@ class TurboDataLoader:
             count = len(list(class_dir.glob('*')))
             logger.info(f"  - {class_dir.name}: {count} images")
 
-    def _augmentation_layers(self):
-        return tf.keras.Sequential([
-            tf.keras.layers.RandomFlip("horizontal"),
-            tf.keras.layers.RandomRotation(0.1),
-            tf.keras.layers.RandomZoom(0.1),
-            tf.keras.layers.RandomContrast(0.1),
-        ])
+    def _augment(self, images, seed):
+        """Random flip, rotation (+-10%), zoom (+-10%) and contrast (+-10%), drawn per image."""
+        flip_seed, rotate_seed, zoom_seed, contrast_seed = tf.unstack(
+            tf.random.experimental.stateless_split(seed, num=4))
+        images = tf.image.stateless_random_flip_left_right(images, flip_seed)
+        batch = tf.shape(images)[0]
+        height = tf.cast(tf.shape(images)[1], tf.float32)
+        width = tf.cast(tf.shape(images)[2], tf.float32)
+        angle = tf.random.stateless_uniform([batch], rotate_seed, -0.2 * np.pi, 0.2 * np.pi)
+        zoom = tf.random.stateless_uniform([batch], zoom_seed, 0.9, 1.1)
+        # Output pixel -> input pixel mapping for a rotation + zoom about the image center.
+        cx, cy = (width - 1) / 2, (height - 1) / 2
+        cos, sin = zoom * tf.cos(angle), zoom * tf.sin(angle)
+        transforms = tf.stack([
+            cos, -sin, cx - cos * cx + sin * cy,
+            sin, cos, cy - sin * cx - cos * cy,
+            tf.zeros_like(cos), tf.zeros_like(cos),
+        ], axis=1)
+        images = tf.raw_ops.ImageProjectiveTransformV3(
+            images=images, transforms=transforms, output_shape=tf.shape(images)[1:3],
+            fill_value=0.0, interpolation="BILINEAR", fill_mode="REFLECT")
+        factor = tf.random.stateless_uniform([batch, 1, 1, 1], contrast_seed, 0.9, 1.1)
+        mean = tf.reduce_mean(images, axis=[1, 2], keepdims=True)
+        return tf.clip_by_value((images - mean) * factor + mean, 0.0, 255.0)
 
     def _load_dataset(self, subset):
+        # Both subsets must shuffle with the same seed: the split is taken from the shuffled file
+        # list, otherwise validation would be the last files in sorted (class) order.
         return tf.keras.utils.image_dataset_from_directory(
             self.data_dir,
             validation_split=self.val_split,
             subset=subset,
-            seed=42,
+            seed=self.seed,
             image_size=(self.img_size, self.img_size),
-            batch_size=self.batch_size,
-            shuffle=(subset == "training"),
+            batch_size=None,
+            shuffle=True,
             label_mode='int'
         )
 
-    def _preprocess(self, ds, is_training=True):
-        normalize_layer = lambda x, y: (tf.cast(x, tf.float32) / 255.0, y)
-        if is_training and self.augment:
-            aug_layer = self._augmentation_layers()
-            preprocess_fn = lambda x, y: normalize_layer(aug_layer(x, training=True), y)
+    def _cache_prefix(self, subset):
+        # Keyed by everything that shapes the cached images, so a changed config or dataset
+        # never silently reads an older run's cache.
+        key = hashlib.blake2b(digest_size=8)
+        key.update(json.dumps([str(self.data_dir.resolve()), self.img_size, self.val_split, self.seed]).encode())
+        for path in sorted(self.data_dir.rglob("*")):
+            if path.is_file():
+                stat = path.stat()
+                key.update(f"{path.relative_to(self.data_dir)}:{stat.st_size}:{stat.st_mtime_ns}\n".encode())
+        prefix = Path(f"{self.cache_file}_{key.hexdigest()}_{subset}")
+        if not prefix.with_name(prefix.name + ".index").exists():
+            # No finished cache: a lockfile or temp state here was left by a run that died while
+            # writing it (one trainer per cache prefix is assumed), so clear it instead of failing.
+            for leftover in [*prefix.parent.glob(f"{prefix.name}_*.lockfile"),
+                             *prefix.parent.glob(f"{prefix.name}*.tempstate*")]:
+                logger.warning(f"Removing stale dataset cache file {leftover}")
+                leftover.unlink(missing_ok=True)
+        return str(prefix)
+
+    def _cache(self, ds, subset):
+        ds = ds.map(lambda x, y: (tf.cast(tf.round(x), tf.uint8), y), num_parallel_calls=tf.data.AUTOTUNE)
+        if self.cache_file:
+            return ds.cache(self._cache_prefix(subset))
+        return ds.cache()
+
+    def _finish(self, ds):
+        # Float conversion last, then prefetch so the next batch is ready when the trainer asks.
+        if self.augment != 'device':
+            ds = ds.map(lambda x, y: (tf.cast(x, tf.float32) / 255.0, y), num_parallel_calls=tf.data.AUTOTUNE)
+        return ds.prefetch(buffer_size=tf.data.AUTOTUNE)
+
+    def _open_shards(self):
+        with open(self.shard_dir / SHARD_INDEX) as f:
+            index = json.load(f)
+        if index['img_size'] != self.img_size:
+            raise ValueError(f"Shards were ingested at img_size={index['img_size']}, not {self.img_size}")
+        images = [np.load(self.shard_dir / f"{shard['name']}_images.npy", mmap_mode='r')
+                  for shard in index['shards']]
+        splits = {"training": [], "validation": []}
+        for rel_path, entry in sorted(index['files'].items()):
+            subset = "validation" if _is_validation(rel_path, self.val_split) else "training"
+            splits[subset].append((entry['shard'], entry['row'], entry['label']))
+        splits = {subset: np.array(rows, dtype=np.int64).reshape(-1, 3) for subset, rows in splits.items()}
+        for subset, rows in splits.items():
+            logger.info(f"{subset.capitalize()} images: {len(rows)}")
+        self._shards = (images, splits)
+        return index['class_names']
+
+    def _shard_batches(self, subset, shuffle_seed=None):
+        """Batches gathered straight from the memory-mapped shards: no decode, no cache copy."""
+        images, splits = self._shards
+        rows = splits[subset]
+        if shuffle_seed is not None:
+            rows = rows[np.random.default_rng(shuffle_seed).permutation(len(rows))]
+
+        def generate():
+            for start in range(0, len(rows), self.batch_size):
+                batch = rows[start:start + self.batch_size]
+                out = np.empty((len(batch), self.img_size, self.img_size, 3), dtype=np.uint8)
+                for shard_id in np.unique(batch[:, 0]):
+                    mask = batch[:, 0] == shard_id
+                    out[mask] = images[shard_id][batch[mask, 1]]
+                yield out, batch[:, 2].astype(np.int32)
+
+        ds = tf.data.Dataset.from_generator(generate, output_signature=(
+            tf.TensorSpec((None, self.img_size, self.img_size, 3), tf.uint8),
+            tf.TensorSpec((None,), tf.int32)))
+        return ds.apply(tf.data.experimental.assert_cardinality(-(-len(rows) // self.batch_size)))
+
+    def train_dataset(self, epoch=0, start_batch=0):
+        """Training batches for ``epoch`` from ``start_batch`` on: per-epoch shuffle order and augmentation seeds."""
+        epoch_seed = self.seed + epoch
+        if self._shards is not None:
+            ds = self._shard_batches("training", shuffle_seed=epoch_seed)
         else:
-            preprocess_fn = normalize_layer
+            ds = self._cached["training"].shuffle(self.shuffle_buffer, seed=epoch_seed,
+                                                  reshuffle_each_iteration=False)
+            ds = ds.batch(self.batch_size)
+        if self.augment and self.augment != 'device':
+            # Skip after enumerate so resumed batches keep their augmentation seeds.
+            ds = ds.enumerate().skip(start_batch).map(
+                lambda i, batch: (self._augment(tf.cast(batch[0], tf.float32),
+                                                tf.stack([tf.constant(epoch_seed, tf.int64), i])), batch[1]),
+                num_parallel_calls=tf.data.AUTOTUNE)
+        elif start_batch:
+            ds = ds.skip(start_batch)
+        return self._finish(ds)
 
-        return ds.map(preprocess_fn, num_parallel_calls=tf.data.AUTOTUNE
-                    ).prefetch(buffer_size=tf.data.AUTOTUNE).cache()
+    def val_dataset(self):
+        if self._shards is not None:
+            return self._finish(self._shard_batches("validation"))
+        return self._finish(self._cached["validation"].batch(self.batch_size))
 
     def load(self):
+        if self.shard_dir is not None:
+            class_names = self._open_shards()
+            return self.train_dataset(0), self.val_dataset(), class_names
         train_ds = self._load_dataset("training")
         val_ds = self._load_dataset("validation")
-        logger.info(f"Training batches: {tf.data.experimental.cardinality(train_ds)}")
-        logger.info(f"Validation batches: {tf.data.experimental.cardinality(val_ds)}")
-        return (
-            self._preprocess(train_ds, is_training=True),
-            self._preprocess(val_ds, is_training=False),
-            train_ds.class_names
-        )
+        class_names = train_ds.class_names
+        logger.info(f"Training images: {tf.data.experimental.cardinality(train_ds)}")
+        logger.info(f"Validation images: {tf.data.experimental.cardinality(val_ds)}")
+        self._cached = {"training": self._cache(train_ds, "training"),
+                        "validation": self._cache(val_ds, "validation")}
+        return self.train_dataset(0), self.val_dataset(), class_names
 
 # ------------------------------
-# Improved CNN Model with BatchNorm and Dropout
+# Preprocessed Dataset Shards
 # ------------------------------
-class FastVisionModel(nn.Module):
-    num_classes: int
-    dropout_rate: float = 0.2
-
-    @nn.compact
-    def __call__(self, x, training=True):
-        # Normalize input to [-1, 1]
-        x = (x - 0.5) * 2.0
-
-        # Stem block
-        x = nn.Conv(32, (3, 3), strides=2, padding='SAME')(x)
-        x = nn.relu(x)
-        x = nn.BatchNorm(use_running_average=not training)(x)
-
-        # Main blocks with residual connections
-        for filters in [64, 128, 256]:
-            residual = x
-            x = self._ds_block(x, filters, training)
-            if residual.shape[-1] == x.shape[-1] and residual.shape[1:3] == x.shape[1:3]:
-                x = x + residual
-
-        # Global pooling and classification head
-        x = jnp.mean(x, axis=(1, 2))
-        if training:
-            x = nn.Dropout(rate=self.dropout_rate)(x, deterministic=not training)
-        x = nn.Dense(features=512)(x)
-        x = nn.relu(x)
-        if training:
-            x = nn.Dropout(rate=self.dropout_rate)(x, deterministic=not training)
-        x = nn.Dense(features=self.num_classes)(x)
-        return x
-
-    def _ds_block(self, x, filters, training):
-        x = nn.Conv(features=x.shape[-1], kernel_size=(3, 3),
-                    feature_group_count=x.shape[-1], padding='SAME')(x)
-        x = nn.Conv(features=filters, kernel_size=(1, 1), padding='SAME')(x)
-        x = nn.relu(x)
-        x = nn.BatchNorm(use_running_average=not training)(x)
-        x = nn.max_pool(x, window_shape=(2, 2), strides=(2, 2), padding='SAME')
-        return x
+SHARD_INDEX = "index.json"
+
+def _is_validation(rel_path, val_split):
+    # Hash of the relative path: the split is stable across incremental ingests.
+    return int(hashlib.md5(rel_path.encode()).hexdigest()[:8], 16) / 2**32 < val_split
+
+def _decode_file(path, img_size):
+    try:
+        with open(path, "rb") as f:
+            return decode_image(f.read(), img_size)
+    except Exception as e:
+        logger.warning(f"Skipping unreadable image {path}: {e}")
+        return None
+
+def _shard_number(path):
+    return int(path.name.split("_")[1])
+
+def _write_shard(shard_dir, index, images, img_size):
+    """Write ``images`` as the next shard file and append it to ``index``; returns its shard id."""
+    shard_files = sorted(shard_dir.glob("shard_*_images.npy"))
+    # Names only ever grow, so a new shard never overwrites a file an older index still points at.
+    number = max([index.get('next_shard', 0)] + [_shard_number(p) + 1 for p in shard_files])
+    name = f"shard_{number:05d}"
+    out = np.lib.format.open_memmap(shard_dir / f"{name}_images.npy", mode='w+',
+                                    dtype=np.uint8, shape=(len(images), img_size, img_size, 3))
+    for row, image in enumerate(images):
+        out[row] = image
+    out.flush()
+    del out
+    index['next_shard'] = number + 1
+    index['shards'].append({'name': name, 'count': len(images)})
+    logger.info(f"Wrote {name} with {len(images)} images")
+    return len(index['shards']) - 1
+
+def _compact_shards(shard_dir, index, files, shard_size, min_live_fraction):
+    """Repack live rows of shards below ``min_live_fraction`` into new shards and renumber the rest."""
+    live = collections.defaultdict(list)
+    for rel_path, entry in files.items():
+        live[entry['shard']].append(rel_path)
+    sparse = [shard_id for shard_id, shard in enumerate(index['shards'])
+              if len(live[shard_id]) < min_live_fraction * shard['count']]
+    moved = sorted((rel_path for shard_id in sparse for rel_path in live[shard_id]),
+                   key=lambda rel_path: (files[rel_path]['shard'], files[rel_path]['row']))
+    # Surviving shards keep their files; only their position in the list changes.
+    old_shards = index['shards']
+    index['shards'] = []
+    renumber = {}
+    for shard_id, shard in enumerate(old_shards):
+        if shard_id not in sparse:
+            renumber[shard_id] = len(index['shards'])
+            index['shards'].append(shard)
+    for rel_path, entry in files.items():
+        if entry['shard'] in renumber:
+            entry['shard'] = renumber[entry['shard']]
+    sources = {shard_id: np.load(shard_dir / f"{old_shards[shard_id]['name']}_images.npy", mmap_mode='r')
+               for shard_id in sparse if live[shard_id]}
+    for start in range(0, len(moved), shard_size):
+        chunk = moved[start:start + shard_size]
+        images = [sources[files[rel_path]['shard']][files[rel_path]['row']] for rel_path in chunk]
+        shard_id = _write_shard(shard_dir, index, images, index['img_size'])
+        for row, rel_path in enumerate(chunk):
+            files[rel_path].update(shard=shard_id, row=row)
+    if sparse:
+        logger.info(f"Compacted {len(sparse)} shards, moving {len(moved)} live images")
+
+def ingest_dataset(data_dir, shard_dir, img_size=128, shard_size=4096, workers=None, rebuild=False,
+                   min_live_fraction=0.5):
+    """Incrementally decode ``data_dir/<class>/<image>`` into uint8 ``.npy`` shards plus a JSON index."""
+    data_dir, shard_dir = Path(data_dir), Path(shard_dir)
+    shard_dir.mkdir(parents=True, exist_ok=True)
+    index_path = shard_dir / SHARD_INDEX
+    index = {'img_size': img_size, 'class_names': [], 'shards': [], 'files': {}}
+    if index_path.exists() and not rebuild:
+        with open(index_path) as f:
+            index = json.load(f)
+        if index['img_size'] != img_size:
+            raise ValueError(f"Shards in {shard_dir} were built at img_size={index['img_size']}; "
+                             f"use rebuild=True to re-ingest at {img_size}")
+
+    class_dirs = sorted(d for d in data_dir.iterdir() if d.is_dir())
+    for class_dir in class_dirs:
+        if class_dir.name not in index['class_names']:
+            index['class_names'].append(class_dir.name)
+
+    files, todo = {}, []
+    for class_dir in class_dirs:
+        label = index['class_names'].index(class_dir.name)
+        for path in sorted(class_dir.iterdir()):
+            if path.suffix.lower() not in IMAGE_EXTENSIONS:
+                continue
+            rel_path = path.relative_to(data_dir).as_posix()
+            stat = path.stat()
+            entry = index['files'].get(rel_path)
+            if entry and entry['mtime'] == stat.st_mtime and entry['size'] == stat.st_size:
+                files[rel_path] = entry
+            else:
+                todo.append((rel_path, path, label, stat))
+    logger.info(f"Ingest: {len(files)} unchanged, {len(todo)} new or changed, "
+                f"{len(index['files']) - len(files)} removed or replaced")
+
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        for start in range(0, len(todo), shard_size):
+            chunk = todo[start:start + shard_size]
+            images = list(pool.map(lambda item: _decode_file(item[1], img_size), chunk))
+            kept = [(item, image) for item, image in zip(chunk, images) if image is not None]
+            if not kept:
+                continue
+            shard_id = _write_shard(shard_dir, index, [image for _, image in kept], img_size)
+            for row, ((rel_path, _, label, stat), _) in enumerate(kept):
+                files[rel_path] = {'mtime': stat.st_mtime, 'size': stat.st_size,
+                                   'label': label, 'shard': shard_id, 'row': row}
+
+    _compact_shards(shard_dir, index, files, shard_size, min_live_fraction)
+    index['files'] = files
+    _atomic_write(index_path, json.dumps(index).encode())
+    # Only after the new index is durable: drop shard files it no longer references (replaced or
+    # compacted rows, leftovers of a rebuild) and the label files older ingests wrote.
+    referenced = {f"{shard['name']}_images.npy" for shard in index['shards']}
+    for path in [*shard_dir.glob("shard_*_images.npy"), *shard_dir.glob("shard_*_labels.npy")]:
+        if path.name not in referenced:
+            path.unlink()
+    logger.info(f"Ingest complete: {len(files)} images in {len(index['shards'])} shards at {shard_dir}")
+    return index
+
+# ------------------------------
+# On-device Augmentation
+# ------------------------------
+def _rotate_zoom(image, angle, zoom):
+    """Bilinear rotation + zoom about the image center with reflected borders."""
+    height, width = image.shape[:2]
+    cy, cx = (height - 1) / 2, (width - 1) / 2
+    ys, xs = jnp.meshgrid(jnp.arange(height, dtype=jnp.float32), jnp.arange(width, dtype=jnp.float32),
+                          indexing='ij')
+    # Output pixel -> input pixel, the same mapping as TurboDataLoader._augment.
+    cos, sin = zoom * jnp.cos(angle), zoom * jnp.sin(angle)
+    x_in = cos * (xs - cx) - sin * (ys - cy) + cx
+    y_in = sin * (xs - cx) + cos * (ys - cy) + cy
+    sample = lambda channel: jax.scipy.ndimage.map_coordinates(channel, [y_in, x_in], order=1, mode='reflect')
+    return jax.vmap(sample, in_axes=2, out_axes=2)(image)
+
+def _cutmix_masks(rng, lam, height, width):
+    """Per-image boxes covering ~``1 - lam`` of the image; returns the masks and the exact kept fraction."""
+    batch = lam.shape[0]
+    cy_rng, cx_rng = jax.random.split(rng)
+    cut = jnp.sqrt(1.0 - lam)
+    cy = jax.random.uniform(cy_rng, (batch,)) * height
+    cx = jax.random.uniform(cx_rng, (batch,)) * width
+    y0, y1 = jnp.clip(cy - cut * height / 2, 0, height), jnp.clip(cy + cut * height / 2, 0, height)
+    x0, x1 = jnp.clip(cx - cut * width / 2, 0, width), jnp.clip(cx + cut * width / 2, 0, width)
+    ys = jnp.arange(height)[None, :, None]
+    xs = jnp.arange(width)[None, None, :]
+    inside = ((ys >= y0[:, None, None]) & (ys < y1[:, None, None]) &
+              (xs >= x0[:, None, None]) & (xs < x1[:, None, None]))
+    kept = 1.0 - jnp.mean(inside, axis=(1, 2))
+    return inside[..., None], kept
+
+def device_augment(rng, images, labels, num_classes, mixup_alpha=0.0, cutmix_alpha=0.0):
+    """Flip/rotate/zoom/contrast (+ optional mixup/cutmix) a uint8 batch on device; returns (images, soft targets)."""
+    images = as_float_images(images)
+    batch, height, width = images.shape[:3]
+    keys = jax.random.split(rng, 8)
+    flip = jax.random.bernoulli(keys[0], 0.5, (batch, 1, 1, 1))
+    images = jnp.where(flip, images[:, :, ::-1], images)
+    angle = jax.random.uniform(keys[1], (batch,), minval=-0.2 * jnp.pi, maxval=0.2 * jnp.pi)
+    zoom = jax.random.uniform(keys[2], (batch,), minval=0.9, maxval=1.1)
+    images = jax.vmap(_rotate_zoom)(images, angle, zoom)
+    factor = jax.random.uniform(keys[3], (batch, 1, 1, 1), minval=0.9, maxval=1.1)
+    mean = jnp.mean(images, axis=(1, 2), keepdims=True)
+    images = jnp.clip((images - mean) * factor + mean, 0.0, 1.0)
+
+    targets = jax.nn.one_hot(labels, num_classes)
+    if not (mixup_alpha or cutmix_alpha):
+        return images, targets
+    partner = jax.random.permutation(keys[4], batch)
+    mixed_images, weights = [], []
+    if mixup_alpha:
+        lam = jax.random.beta(keys[5], mixup_alpha, mixup_alpha, (batch,))
+        mixed_images.append(lam[:, None, None, None] * images +
+                            (1 - lam[:, None, None, None]) * images[partner])
+        weights.append(lam)
+    if cutmix_alpha:
+        lam = jax.random.beta(keys[6], cutmix_alpha, cutmix_alpha, (batch,))
+        inside, kept = _cutmix_masks(keys[7], lam, height, width)
+        mixed_images.append(jnp.where(inside, images[partner], images))
+        weights.append(kept)
+    if len(mixed_images) == 2:
+        use_mixup = jax.random.bernoulli(jax.random.fold_in(rng, 1), 0.5, (batch,))
+        images = jnp.where(use_mixup[:, None, None, None], mixed_images[0], mixed_images[1])
+        weight = jnp.where(use_mixup, weights[0], weights[1])
+    else:
+        images, weight = mixed_images[0], weights[0]
+    targets = weight[:, None] * targets + (1 - weight[:, None]) * targets[partner]
+    return images, targets
 
 # ------------------------------
 # Optimized Trainer with Learning Rate Scheduling and BatchNorm/Dropout handling
 # ------------------------------
 class SpeedTrainer:
-    def __init__(self, num_classes, lr=1e-3, weight_decay=1e-4, dropout_rate=0.2):
+    def __init__(self, num_classes, lr=1e-3, weight_decay=1e-4, dropout_rate=0.2, data_parallel=False,
+                 precision='float32', device_augment=False, mixup_alpha=0.0, cutmix_alpha=0.0):
         self.num_classes = num_classes
-        self.model = FastVisionModel(num_classes=num_classes, dropout_rate=dropout_rate)
+        # Augment uint8 batches inside the compiled train step (see ``device_augment``).
+        self.device_augment = device_augment
+        self.mixup_alpha = mixup_alpha
+        self.cutmix_alpha = cutmix_alpha
+        self.model = FastVisionModel(num_classes=num_classes, dropout_rate=dropout_rate, precision=precision)
         self.lr = lr
         self.weight_decay = weight_decay
+        self.data_parallel = data_parallel
+        if data_parallel:
+            # One mesh axis over all local devices: the state is replicated, every global batch
+            # is split along its leading dimension. XLA inserts the gradient all-reduce, and the
+            # BatchNorm moments are reduced over the whole global batch, so batch_stats stay
+            # identical across replicas.
+            devices = jax.local_devices()
+            self.mesh = jax.sharding.Mesh(np.array(devices), ('data',))
+            self.replicated = jax.sharding.NamedSharding(self.mesh, jax.sharding.PartitionSpec())
+            self.data_sharding = jax.sharding.NamedSharding(self.mesh, jax.sharding.PartitionSpec('data'))
+            logger.info(f"Data-parallel training over {len(devices)} devices")
+
+    def shard_state(self, state):
+        """Replicate the train state across the mesh (no-op without data parallelism)."""
+        if not self.data_parallel:
+            return state
+        return jax.device_put(state, self.replicated)
+
+    def shard_batch(self, batch, stacked=False):
+        """Split a global batch across devices (batch axis 1 when ``stacked``); ragged batches are replicated."""
+        if not self.data_parallel:
+            return batch
+        batch_dim = 1 if stacked else 0
+        if batch[0].shape[batch_dim] % self.mesh.size:
+            return jax.device_put(batch, self.replicated)
+        if stacked:
+            return jax.device_put(batch, jax.sharding.NamedSharding(
+                self.mesh, jax.sharding.PartitionSpec(None, 'data')))
+        return jax.device_put(batch, self.data_sharding)
 
     def create_state(self, rng, input_shape=(1, 128, 128, 3)):
         # Initialize model variables; extract both parameters and batch_stats.
@@ -192,11 +509,7 @@ class SpeedTrainer:
         batch_stats = variables.get('batch_stats', {})
 
         def lr_schedule(step):
-            warmup_steps = 100
-            decay_steps = 5000
-            warmup_factor = jnp.minimum(1.0, step / warmup_steps)
-            decay_factor = 0.5 * (1 + jnp.cos(jnp.pi * jnp.minimum(step - warmup_steps, decay_steps) / decay_steps))
-            return self.lr * warmup_factor * decay_factor
+            return self.lr * SpeedTrainer.lr_factor(step)
 
         tx = optax.chain(
             optax.clip_by_global_norm(1.0),
@@ -210,22 +523,63 @@ class SpeedTrainer:
             batch_stats=batch_stats
         )
 
+    @staticmethod
+    def lr_factor(step):
+        """Linear warmup then cosine decay, as a fraction of the peak learning rate."""
+        warmup_steps = 100
+        decay_steps = 5000
+        warmup_factor = jnp.minimum(1.0, step / warmup_steps)
+        decay_factor = 0.5 * (1 + jnp.cos(jnp.pi * jnp.minimum(step - warmup_steps, decay_steps) / decay_steps))
+        return warmup_factor * decay_factor
+
     @staticmethod
     def cross_entropy_loss(logits, labels):
-        one_hot = jax.nn.one_hot(labels, logits.shape[-1])
-        loss = optax.softmax_cross_entropy(logits=logits, labels=one_hot)
+        """Mean cross-entropy against integer labels or (batch, classes) soft targets."""
+        targets = labels if labels.ndim == 2 else jax.nn.one_hot(labels, logits.shape[-1])
+        loss = optax.softmax_cross_entropy(logits=logits, labels=targets)
         return loss.mean()
 
     @functools.partial(jax.jit, static_argnums=(0,))
     def train_step(self, state, batch, dropout_rng):
+        return self._train_step(state, batch, dropout_rng)
+
+    @functools.partial(jax.jit, static_argnums=(0,))
+    def train_multi_step(self, state, batches, rng, metric_sums):
+        """Run K stacked batches (leading axis K) in one ``lax.scan``, summing metrics on device."""
+        def body(carry, batch):
+            state, sums = carry
+            dropout_rng = jax.random.fold_in(rng, state.step)
+            state, metrics = self._train_step(state, batch, dropout_rng)
+            return (state, accumulate_metrics(sums, metrics)), None
+
+        # Fully unrolled: K is small, and XLA:CPU runs convolutions inside a rolled while loop
+        # many times slower than in straight-line code.
+        (state, metric_sums), _ = jax.lax.scan(body, (state, metric_sums), batches, unroll=True)
+        return state, metric_sums
+
+    def _prepare_batch(self, batch, rng):
+        """Float images and training targets for ``batch``, plus the rng left over for dropout."""
         images, labels = batch
+        if not self.device_augment:
+            return as_float_images(images), labels, rng
+        augment_rng, rng = jax.random.split(rng)
+        images, targets = device_augment(augment_rng, images, labels, self.num_classes,
+                                         self.mixup_alpha, self.cutmix_alpha)
+        return images, targets, rng
+
+    def _train_step(self, state, batch, dropout_rng):
+        images, targets, dropout_rng = self._prepare_batch(batch, dropout_rng)
+        return self._update(state, images, targets, batch[1], dropout_rng)
+
+    def _update(self, state, images, targets, labels, dropout_rng, dropout_rate=None):
         def loss_fn(params):
             # Include batch_stats in variables for BatchNorm and pass dropout rng for Dropout.
             variables = {'params': params, 'batch_stats': state.batch_stats}
             (logits, new_model_state) = self.model.apply(
-                variables, images, training=True, mutable=['batch_stats'], rngs={'dropout': dropout_rng}
+                variables, images, training=True, dropout_rate=dropout_rate, mutable=['batch_stats'],
+                rngs={'dropout': dropout_rng}
             )
-            loss = SpeedTrainer.cross_entropy_loss(logits, labels)
+            loss = SpeedTrainer.cross_entropy_loss(logits, targets)
             return loss, (logits, new_model_state)
 
         (loss, (logits, new_model_state)), grads = jax.value_and_grad(loss_fn, has_aux=True)(state.params)
@@ -238,7 +592,11 @@ class SpeedTrainer:
 
     @functools.partial(jax.jit, static_argnums=(0,))
     def eval_step(self, state, batch):
+        return self._eval_step(state, batch)
+
+    def _eval_step(self, state, batch):
         images, labels = batch
+        images = as_float_images(images)
         variables = {'params': state.params, 'batch_stats': state.batch_stats}
         logits = self.model.apply(variables, images, training=False, mutable=False)
         loss = SpeedTrainer.cross_entropy_loss(logits, labels)
@@ -246,6 +604,79 @@ class SpeedTrainer:
         acc = jnp.mean(preds == labels)
         return {'loss': loss, 'acc': acc}
 
+class SweepTrainer(SpeedTrainer):
+    """Trains one replica per hyperparameter config (lr, weight_decay, dropout_rate) in one vmapped step."""
+    def __init__(self, num_classes, configs, precision='float32', device_augment=False,
+                 mixup_alpha=0.0, cutmix_alpha=0.0):
+        super().__init__(num_classes, precision=precision, device_augment=device_augment,
+                         mixup_alpha=mixup_alpha, cutmix_alpha=cutmix_alpha)
+        self.configs = [{'lr': self.lr, 'weight_decay': self.weight_decay, 'dropout_rate': 0.2, **config}
+                        for config in configs]
+        self.num_replicas = len(self.configs)
+        self.lrs = np.array([c['lr'] for c in self.configs], np.float32)
+        self.weight_decays = np.array([c['weight_decay'] for c in self.configs], np.float32)
+        self.dropout_rates = np.array([c['dropout_rate'] for c in self.configs], np.float32)
+
+    def create_state(self, rng, input_shape=(1, 128, 128, 3)):
+        tx = optax.chain(
+            optax.clip_by_global_norm(1.0),
+            optax.inject_hyperparams(optax.adamw)(learning_rate=0.0, weight_decay=0.0)
+        )
+
+        def init(rng, weight_decay):
+            variables = self.model.init(rng, jnp.ones(input_shape))
+            state = TrainStateWithBN.create(apply_fn=self.model.apply, params=variables['params'], tx=tx,
+                                            batch_stats=variables.get('batch_stats', {}))
+            return self._set_hyperparams(state, learning_rate=0.0, weight_decay=weight_decay)
+
+        return jax.jit(jax.vmap(init))(jax.random.split(rng, self.num_replicas), self.weight_decays)
+
+    @staticmethod
+    def _set_hyperparams(state, **values):
+        clip_state, adamw_state = state.opt_state
+        hyperparams = {**adamw_state.hyperparams,
+                       **{k: jnp.asarray(v, jnp.float32) for k, v in values.items()}}
+        return state.replace(opt_state=(clip_state, adamw_state._replace(hyperparams=hyperparams)))
+
+    @functools.partial(jax.jit, static_argnums=(0,))
+    def train_step(self, states, batch, rng, active):
+        """One step for every replica; replicas with ``active`` False are left unchanged."""
+        images, targets, rng = self._prepare_batch(batch, rng)
+
+        def step(state, dropout_rng, lr, dropout_rate, active):
+            state = self._set_hyperparams(state, learning_rate=lr * SpeedTrainer.lr_factor(state.step))
+            new_state, metrics = self._update(state, images, targets, batch[1], dropout_rng, dropout_rate)
+            return jax.tree_util.tree_map(lambda new, old: jnp.where(active, new, old), new_state, state), metrics
+
+        return jax.vmap(step)(states, jax.random.split(rng, self.num_replicas), self.lrs,
+                              self.dropout_rates, active)
+
+    @functools.partial(jax.jit, static_argnums=(0,))
+    def eval_step(self, states, batch):
+        return jax.vmap(self._eval_step, in_axes=(0, None))(states, batch)
+
+    @staticmethod
+    @jax.jit
+    def keep_best(improved, states, best_states):
+        """Per replica: ``states`` where ``improved``, else ``best_states``."""
+        def select(new, old):
+            return jnp.where(improved.reshape(improved.shape + (1,) * (new.ndim - 1)), new, old)
+        return jax.tree_util.tree_map(select, states, best_states)
+
+    @staticmethod
+    def replica(states, index):
+        return jax.tree_util.tree_map(lambda x: x[index], states)
+
+def init_metric_sums():
+    return {'loss': jnp.zeros((), jnp.float32), 'acc': jnp.zeros((), jnp.float32),
+            'count': jnp.zeros((), jnp.int32)}
+
+@jax.jit
+def accumulate_metrics(sums, metrics):
+    return {'loss': sums['loss'] + metrics['loss'].astype(jnp.float32),
+            'acc': sums['acc'] + metrics['acc'].astype(jnp.float32),
+            'count': sums['count'] + 1}
+
 # ------------------------------
 # Enhanced Progress Tracking with Visualization
 # ------------------------------
@@ -269,11 +700,19 @@ class TrainingProgress:
             f"{phase.capitalize()} Batch - Loss: {metrics['loss']:.4f} | Acc: {metrics['acc']:.4f}"
         )
         self.batch_bar.refresh()
+    @staticmethod
+    def epoch_mean(metrics, key):
+        """Mean of per-step metrics: a list of step dicts, or on-device sums with a 'count'."""
+        if isinstance(metrics, dict):
+            return float(metrics[key]) / max(int(metrics['count']), 1)
+        return np.mean([m[key] for m in metrics])
     def update_metrics(self, train_metrics, val_metrics):
-        train_loss = np.mean([m['loss'] for m in train_metrics])
-        train_acc  = np.mean([m['acc'] for m in train_metrics])
-        val_loss   = np.mean([m['loss'] for m in val_metrics])
-        val_acc    = np.mean([m['acc'] for m in val_metrics])
+        # One device-to-host transfer for everything accumulated during the epoch.
+        train_metrics, val_metrics = jax.device_get((train_metrics, val_metrics))
+        train_loss = self.epoch_mean(train_metrics, 'loss')
+        train_acc  = self.epoch_mean(train_metrics, 'acc')
+        val_loss   = self.epoch_mean(val_metrics, 'loss')
+        val_acc    = self.epoch_mean(val_metrics, 'acc')
         self.metrics_bar.set_description_str(
             f"Epoch Metrics - Train Loss: {train_loss:.4f} | Train Acc: {train_acc:.4f} | "
             f"Val Loss: {val_loss:.4f} | Val Acc: {val_acc:.4f}"
@@ -312,12 +751,183 @@ class TrainingProgress:
         except ImportError:
             logger.warning("Matplotlib not available, skipping plot")
 
+# ------------------------------
+# Step Profiling
+# ------------------------------
+class StepProfiler:
+    """Opt-in data wait / host-to-device / compute split of training steps, plus an optional jax.profiler trace."""
+    def __init__(self, enabled=False, sample_every=10, trace_dir=None, trace_steps=None):
+        self.enabled = enabled
+        self.sample_every = max(1, sample_every)
+        self.trace_dir = trace_dir
+        self.trace_steps = trace_steps if trace_dir else None
+        self.tracing = False
+        self.step = 0         # global train step
+        self.sampled = False
+        self.shapes = set()   # batch shapes already compiled
+        self.reset()
+
+    def reset(self):
+        self.epoch_start = time.perf_counter()
+        self.dispatches = 0   # train_step / train_multi_step calls this epoch
+        self.steps = 0
+        self.data_wait = 0.0
+        self.sampled_steps = 0
+        self.transfer_time = 0.0
+        self.compute_time = 0.0
+
+    def fetch(self, iterator):
+        if not self.enabled:
+            return next(iterator)
+        start = time.perf_counter()
+        batch = next(iterator)
+        self.data_wait += time.perf_counter() - start
+        return batch
+
+    def transfer(self, put, batch, pending=None):
+        """``put(batch)``; on sampled dispatches, first drain ``pending`` and time the copy."""
+        shape = batch[0].shape
+        self.sampled = self.enabled and shape in self.shapes and (
+            self.dispatches % self.sample_every == 0 or not self.sampled_steps)
+        self.shapes.add(shape)
+        if not self.sampled:
+            return put(batch)
+        jax.block_until_ready(pending)
+        start = time.perf_counter()
+        batch = jax.block_until_ready(jax.device_put(put(batch)))
+        self.transfer_time += time.perf_counter() - start
+        return batch
+
+    def compute(self, step_fn, *args, num_steps=1):
+        if self.trace_steps and not self.tracing and self.trace_steps[0] <= self.step < self.trace_steps[1]:
+            jax.profiler.start_trace(self.trace_dir)
+            self.tracing = True
+            logger.info(f"Profiler trace started at step {self.step}")
+        start = time.perf_counter()
+        outputs = step_fn(*args)
+        if self.sampled:
+            jax.block_until_ready(outputs)
+            self.compute_time += time.perf_counter() - start
+            self.sampled_steps += num_steps
+        self.dispatches += 1
+        self.steps += num_steps
+        self.step += num_steps
+        if self.tracing and self.step >= self.trace_steps[1]:
+            self.stop_trace(outputs)
+        return outputs
+
+    def stop_trace(self, pending=None):
+        if self.tracing:
+            jax.block_until_ready(pending)
+            jax.profiler.stop_trace()
+            self.tracing = False
+            logger.info(f"Profiler trace for steps {self.trace_steps[0]}-{self.step} written to {self.trace_dir}")
+
+    def epoch_summary(self, epoch):
+        """Log and return the epoch's time split; transfer and compute are extrapolated from samples."""
+        if not self.enabled or not self.steps:
+            return None
+        if not self.sampled_steps:
+            logger.info(f"Epoch {epoch} profile: every step compiled, no timing samples")
+            self.reset()
+            return None
+        per_step = self.sampled_steps
+        transfer = self.transfer_time / per_step * self.steps
+        compute = self.compute_time / per_step * self.steps
+        total = self.data_wait + transfer + compute
+        input_fraction = (self.data_wait + transfer) / total if total else 0.0
+        summary = {
+            'epoch': epoch,
+            'steps': self.steps,
+            'wall_s': time.perf_counter() - self.epoch_start,
+            'data_wait_s': self.data_wait,
+            'transfer_s': transfer,
+            'compute_s': compute,
+            'input_fraction': input_fraction,
+            'bound': 'input' if input_fraction > 0.5 else 'compute',
+        }
+        logger.info(f"Epoch {epoch} profile: {summary['bound']}-bound | data wait {self.data_wait:.2f}s | "
+                    f"H2D {transfer:.2f}s | compute {compute:.2f}s | "
+                    f"{input_fraction:.0%} of step time waiting on input ({self.sampled_steps} sampled steps)")
+        self.reset()
+        return summary
+
+# ------------------------------
+# Asynchronous Checkpointing
+# ------------------------------
+class AsyncCheckpointer:
+    """Writes train-state checkpoints with resume metadata on a background thread."""
+    def __init__(self, directory, keep_latest=2, keep_best=1):
+        self.directory = Path(directory)
+        self.keep = {'latest': keep_latest, 'best': keep_best}
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="checkpoint")
+        self._pending = None
+
+    def _path(self, kind, step):
+        return self.directory / kind / f"ckpt_{step:06d}.msgpack"
+
+    def save(self, kinds, step, state, metadata):
+        """Queue one snapshot of ``state`` for each of ``kinds`` ("latest", "best"), serialized once."""
+        self.wait()  # blocks only if the previous snapshot is still being written
+        for leaf in jax.tree_util.tree_leaves(state):
+            if isinstance(leaf, jax.Array):
+                leaf.copy_to_host_async()
+        self._pending = self._executor.submit(self._write, tuple(kinds), step, state, metadata)
+
+    def _write(self, kinds, step, state, metadata):
+        bundle = {'state': serialization.to_state_dict(jax.device_get(state)), 'metadata': metadata}
+        first = self._path(kinds[0], step)
+        for i, kind in enumerate(kinds):
+            path = self._path(kind, step)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            if i == 0:
+                _atomic_write(path, serialization.msgpack_serialize(bundle))
+            else:
+                # Further kinds share the written file: hard link (copy across filesystems), then rename.
+                tmp_path = path.with_name(path.name + ".tmp")
+                tmp_path.unlink(missing_ok=True)
+                try:
+                    os.link(first, tmp_path)
+                except OSError:
+                    shutil.copyfile(first, tmp_path)
+                os.replace(tmp_path, path)
+            for old in self.list(kind)[:-self.keep.get(kind, 1)]:
+                old.unlink()
+
+    def wait(self):
+        if self._pending is not None:
+            self._pending.result()  # re-raises a failed write
+            self._pending = None
+
+    def list(self, kind):
+        """``kind`` checkpoints, oldest write first."""
+        return sorted((self.directory / kind).glob("ckpt_*.msgpack"),
+                      key=lambda p: (p.stat().st_mtime_ns, p.name))
+
+    def restore(self, kind, target):
+        """Most recently written ``kind`` checkpoint as (state shaped like ``target``, metadata), or None."""
+        self.wait()
+        paths = self.list(kind)
+        if not paths:
+            return None
+        with open(paths[-1], "rb") as f:
+            bundle = serialization.msgpack_restore(f.read())
+        return serialization.from_state_dict(target, bundle['state']), bundle['metadata']
+
+    def close(self):
+        self.wait()
+        self._executor.shutdown()
+
 # ------------------------------
 # Enhanced Turbo Pipeline with Early Stopping
 # ------------------------------
 class TurboPipeline:
     def __init__(self, data_dir, max_time=7200, img_size=128, batch_size=64,
-                 patience=5, epochs=50, dropout_rate=0.2):
+                 patience=5, epochs=50, dropout_rate=0.2, compilation_cache_dir=None,
+                 data_parallel=False, num_cpu_devices=None, steps_per_call=1, dataset_cache=None,
+                 shard_dir=None, precision='float32', resume=False, profile=False, profile_every=10,
+                 trace_dir=None, trace_steps=(10, 20), augment='tf', mixup_alpha=0.0, cutmix_alpha=0.0,
+                 checkpoint_every=0, parity_baseline=None):
         self.data_dir = data_dir
         self.max_time = max_time      # Maximum training time in seconds (set to 7200 for 2 hours)
         self.img_size = img_size
@@ -325,56 +935,189 @@ class TurboPipeline:
         self.patience = patience      # Early stopping patience (epochs)
         self.epochs = epochs
         self.dropout_rate = dropout_rate
+        self.compilation_cache_dir = compilation_cache_dir  # Optional on-disk XLA cache
+        self.data_parallel = data_parallel      # Shard each batch across all local devices
+        self.num_cpu_devices = num_cpu_devices  # Forced XLA host devices when running on CPU
+        self.steps_per_call = steps_per_call    # >1 fuses that many train steps into one lax.scan
+        self.dataset_cache = dataset_cache      # On-disk uint8 cache prefix (None caches in memory)
+        self.shard_dir = shard_dir              # Read ingested .npy shards instead of the image tree
+        self.precision = precision              # 'float32' or 'bfloat16' (mixed precision)
+        self.resume = resume                    # Continue from the latest checkpoint if there is one
+        self.profile = profile                  # Log a data-wait / H2D / compute split per epoch
+        self.profile_every = profile_every      # Synchronize every Nth dispatch to time device work
+        self.trace_dir = trace_dir              # Capture a jax.profiler trace of trace_steps here
+        self.trace_steps = trace_steps          # [start, stop) global train steps to trace
+        self.augment = augment                  # 'tf' (tf.data, host), 'device' (in the train step) or None
+        self.mixup_alpha = mixup_alpha          # Beta(alpha, alpha) mixup, 'device' augmentation only
+        self.cutmix_alpha = cutmix_alpha        # Beta(alpha, alpha) cutmix, 'device' augmentation only
+        self.checkpoint_every = checkpoint_every  # Also checkpoint every N train batches mid-epoch (0: epoch ends only)
+        self.parity_baseline = parity_baseline  # float32-trained artifact to measure non-float32 training against
         self.checkpoint_dir = os.path.abspath("checkpoints") # Changed to absolute path
         os.makedirs(self.checkpoint_dir, exist_ok=True)
 
     def _get_num_batches(self, dataset):
         return tf.data.experimental.cardinality(dataset).numpy()
 
+    def _checkpoint_run_dir(self):
+        """This run's checkpoint directory: the last run's when resuming, otherwise a fresh one."""
+        pointer = Path(self.checkpoint_dir) / "LATEST_RUN"
+        if self.resume and pointer.exists():
+            return Path(self.checkpoint_dir) / pointer.read_text().strip()
+        run_id = f"run_{time.strftime('%Y%m%d-%H%M%S')}_{os.getpid()}"
+        _atomic_write(pointer, run_id.encode())
+        return Path(self.checkpoint_dir) / run_id
+
+    def _train_epoch_fused(self, trainer, state, train_iter, train_batches, rng, progress, profiler,
+                           start_batch=0, checkpoint=None):
+        """Train one epoch ``steps_per_call`` batches at a time with on-device metric sums."""
+        sums = init_metric_sums()
+        pending = []
+        report_every = max(1, train_batches // 20)  # progress update every 5%
+
+        def run(state, sums, batches):
+            stacked = tuple(np.stack(arrays) for arrays in zip(*batches))
+            stacked = profiler.transfer(lambda b: trainer.shard_batch(b, stacked=True), stacked, state)
+            return profiler.compute(trainer.train_multi_step, state, stacked, rng, sums,
+                                    num_steps=len(batches))
+
+        for batch_idx in range(start_batch, train_batches):
+            batch = profiler.fetch(train_iter)
+            if len(batch[0]) == self.batch_size:
+                pending.append(batch)
+            else:
+                # Ragged final batch: its own single-step call rather than a new stacked shape.
+                state, sums = run(state, sums, [batch])
+            if len(pending) == self.steps_per_call:
+                state, sums = run(state, sums, pending)
+                pending = []
+                if checkpoint is not None:
+                    checkpoint(batch_idx + 1, state)
+            if (batch_idx + 1) % report_every == 0:
+                means = jax.device_get(sums)
+                progress.update_batch({k: TrainingProgress.epoch_mean(means, k) for k in ('loss', 'acc')}, "train")
+        for batch in pending:
+            state, sums = run(state, sums, [batch])
+        return state, sums
+
+    def _load_data(self, **cache_key):
+        setup_hardware(self.num_cpu_devices)
+        logger.info("Loading and preparing datasets...")
+        loader = TurboDataLoader(
+            self.data_dir,
+            self.img_size,
+            self.batch_size,
+            augment=self.augment,
+            cache_file=self.dataset_cache,
+            shard_dir=self.shard_dir
+        )
+        train_ds, val_ds, class_names = loader.load()
+        logger.info(f"Loaded {len(class_names)} classes: {class_names}")
+        if self.compilation_cache_dir:
+            enable_compilation_cache(
+                self.compilation_cache_dir, model="FastVisionModel", num_classes=len(class_names),
+                precision=self.precision, input_shape=(self.batch_size, self.img_size, self.img_size, 3),
+                **cache_key
+            )
+        return loader, train_ds, val_ds, class_names
+
     def run(self):
         progress = None
+        checkpointer = AsyncCheckpointer(self._checkpoint_run_dir())
         try:
-            setup_hardware()
-            logger.info("Loading and preparing datasets...")
-            loader = TurboDataLoader(
-                self.data_dir,
-                self.img_size,
-                self.batch_size,
-                augment=True
-            )
-            train_ds, val_ds, class_names = loader.load()
-            logger.info(f"Loaded {len(class_names)} classes: {class_names}")
+            loader, train_ds, val_ds, class_names = self._load_data(dropout_rate=self.dropout_rate)
+            if self.parity_baseline and self.precision != 'float32':
+                load_parity_baseline(self.parity_baseline, class_names)  # fail before training, not after
             progress = TrainingProgress(self.epochs)
             logger.info("Initializing model and training state...")
-            trainer = SpeedTrainer(num_classes=len(class_names), dropout_rate=self.dropout_rate)
+            trainer = SpeedTrainer(num_classes=len(class_names), dropout_rate=self.dropout_rate,
+                                   data_parallel=self.data_parallel, precision=self.precision,
+                                   device_augment=self.augment == 'device', mixup_alpha=self.mixup_alpha,
+                                   cutmix_alpha=self.cutmix_alpha)
             rng = jax.random.PRNGKey(int(time.time()))
             state = trainer.create_state(rng, input_shape=(1, self.img_size, self.img_size, 3))
             train_batches = self._get_num_batches(train_ds)
             val_batches = self._get_num_batches(val_ds)
             best_val_acc = 0.0
             early_stop_counter = 0
-            start_time = time.time()
-            for epoch in range(self.epochs):
+            start_epoch = 0
+            start_batch = 0
+            elapsed = 0.0
+            restored = checkpointer.restore("latest", state) if self.resume else None
+            if restored is not None:
+                state, meta = restored
+                # Datasets are seeded per epoch and batch, so skipping to the saved position with
+                # the saved RNG replays exactly what the interrupted run would have done. Only the
+                # train metrics of a resumed partial epoch cover just its remaining batches.
+                rng = jnp.asarray(meta['rng'])
+                start_epoch = int(meta['epoch'])
+                start_batch = int(meta.get('batch', 0))
+                best_val_acc = float(meta['best_val_acc'])
+                early_stop_counter = int(meta['early_stop_counter'])
+                elapsed = float(meta['elapsed'])
+                progress.history = {k: list(v) for k, v in meta['history'].items()}
+                progress.epoch_bar.update(start_epoch)
+                logger.info(f"Resumed from checkpoint at epoch {start_epoch}, batch {start_batch} "
+                            f"(best val acc {best_val_acc:.4f})")
+            state = trainer.shard_state(state)
+            profiler = StepProfiler(self.profile, self.profile_every, self.trace_dir, self.trace_steps)
+            profiler.step = int(jax.device_get(state.step))
+            start_time = time.time() - elapsed
+
+            def checkpoint_meta(epoch, batch):
+                return {
+                    'epoch': epoch,
+                    'batch': batch,
+                    'rng': np.asarray(jax.device_get(rng)),
+                    'best_val_acc': best_val_acc,
+                    'early_stop_counter': early_stop_counter,
+                    'elapsed': time.time() - start_time,
+                    'history': {k: [float(v) for v in vs] for k, vs in progress.history.items()},
+                }
+
+            def checkpoint_mid_epoch(batches_done, state):
+                nonlocal last_checkpoint
+                if batches_done < train_batches and batches_done - last_checkpoint >= self.checkpoint_every:
+                    checkpointer.save(("latest",), epoch * train_batches + batches_done, state,
+                                      checkpoint_meta(epoch, batches_done))
+                    last_checkpoint = batches_done
+
+            for epoch in range(start_epoch, self.epochs):
                 epoch_start = time.time()
+                skip = start_batch if epoch == start_epoch else 0
+                last_checkpoint = skip
+                checkpoint = checkpoint_mid_epoch if self.checkpoint_every else None
+                train_ds = loader.train_dataset(epoch, start_batch=skip)
                 train_iter = iter(train_ds.as_numpy_iterator())
-                train_metrics = []
-                last_reported = 0  # For progress update every 5%
-                for batch_idx in range(train_batches):
-                    batch = next(train_iter)
-                    # Split rng for dropout
-                    dropout_rng, rng = jax.random.split(rng)
-                    state, metrics = trainer.train_step(state, batch, dropout_rng)
-                    train_metrics.append(metrics)
-                    current_percent = int(((batch_idx + 1) / train_batches) * 100)
-                    if current_percent >= last_reported + 5:
-                        progress.update_batch(metrics, "train")
-                        last_reported = current_percent
+                profiler.reset()
+                if self.steps_per_call > 1:
+                    state, train_metrics = self._train_epoch_fused(
+                        trainer, state, train_iter, train_batches, jax.random.fold_in(rng, epoch), progress,
+                        profiler, start_batch=skip, checkpoint=checkpoint)
+                else:
+                    train_metrics = []
+                    last_reported = 0  # For progress update every 5%
+                    for batch_idx in range(skip, train_batches):
+                        batch = profiler.transfer(trainer.shard_batch, profiler.fetch(train_iter), state)
+                        # Split rng for dropout
+                        dropout_rng, rng = jax.random.split(rng)
+                        state, metrics = profiler.compute(trainer.train_step, state, batch, dropout_rng)
+                        train_metrics.append(metrics)
+                        if checkpoint is not None:
+                            checkpoint(batch_idx + 1, state)
+                        current_percent = int(((batch_idx + 1) / train_batches) * 100)
+                        if current_percent >= last_reported + 5:
+                            progress.update_batch(metrics, "train")
+                            last_reported = current_percent
                 val_iter = iter(val_ds.as_numpy_iterator())
-                val_metrics = []
+                val_metrics = init_metric_sums() if self.steps_per_call > 1 else []
                 for _ in range(val_batches):
-                    batch = next(val_iter)
+                    batch = trainer.shard_batch(next(val_iter))
                     metrics = trainer.eval_step(state, batch)
-                    val_metrics.append(metrics)
+                    if self.steps_per_call > 1:
+                        val_metrics = accumulate_metrics(val_metrics, metrics)
+                    else:
+                        val_metrics.append(metrics)
+                profiler.epoch_summary(epoch + 1)
                 train_acc, val_acc, train_loss, val_loss = progress.update_metrics(train_metrics, val_metrics)
                 epoch_time = time.time() - epoch_start
                 progress.update_epoch()
@@ -382,19 +1125,16 @@ class TurboPipeline:
                 print(f"Progress: {(epoch+1)/self.epochs*100:.1f}% | Epoch: {epoch+1}/{self.epochs} | "
                       f"Train Acc: {train_acc:.4f} | Val Acc: {val_acc:.4f} | "
                       f"Train Loss: {train_loss:.4f} | Val Loss: {val_loss:.4f} | Epoch Time: {epoch_time:.2f}s")
-                if val_acc > best_val_acc:
-                    best_val_acc = val_acc
+                improved = val_acc > best_val_acc
+                if improved:
+                    best_val_acc = float(val_acc)
                     early_stop_counter = 0
-                    checkpoints.save_checkpoint(
-                        ckpt_dir=self.checkpoint_dir,
-                        target=state,
-                        step=epoch,
-                        prefix="best_model_",
-                        overwrite=True
-                    )
                     logger.info(f"Epoch {epoch+1}: New best model with val acc: {val_acc:.4f}")
                 else:
                     early_stop_counter += 1
+                meta = checkpoint_meta(epoch + 1, 0)
+                checkpointer.save(("latest", "best") if improved else ("latest",),
+                                  (epoch + 1) * train_batches, state, meta)
                 if early_stop_counter >= self.patience:
                     logger.info(f"Early stopping after {epoch+1} epochs without improvement")
                     break
@@ -402,202 +1142,241 @@ class TurboPipeline:
                 if elapsed > self.max_time:
                     logger.info(f"Time limit of {self.max_time}s reached after {epoch+1} epochs")
                     break
+            profiler.stop_trace(state)
             total_time = time.time() - start_time
             logger.info(f"Training completed in {total_time:.2f}s with best val acc: {best_val_acc:.4f}")
+            if self.compilation_cache_dir:
+                stats = compilation_cache_stats()
+                logger.info(f"Compilation cache: {stats['hits']} hits, {stats['misses']} misses")
             progress.plot_history()
             progress.close()
-            best_state = checkpoints.restore_checkpoint(
-                ckpt_dir=self.checkpoint_dir,
-                target=state,
-                prefix="best_model_"
-            )
+            best = checkpointer.restore("best", state)
+            best_state = best[0] if best is not None else state
+            checkpointer.close()
+            if self.precision != 'float32':
+                parity = precision_parity(
+                    {'params': best_state.params, 'batch_stats': best_state.batch_stats},
+                    class_names, loader.val_dataset(), precision=self.precision,
+                    dropout_rate=self.dropout_rate, baseline_path=self.parity_baseline)
+                logger.info(f"Precision parity on validation set vs {parity['reference']}: {parity}")
             return best_state, class_names
         except Exception as e:
             if progress is not None:
                 progress.close()
+            try:
+                checkpointer.close()
+            except Exception as write_error:  # keep the original failure as the one raised
+                logger.error(f"Checkpoint write failed: {write_error}")
             logger.error(f"Pipeline failed: {str(e)}")
             raise
 
-# ------------------------------
-# Model Inference and Visualization
-# ------------------------------
-class ModelInference:
-    def __init__(self, state, class_names, img_size=128):
-        self.state = state
-        self.class_names = class_names
-        self.img_size = img_size
+    def sweep(self, configs, output_dir="sweep"):
+        """Train one replica per config on a single data pass and export each replica's best weights."""
+        loader, train_ds, val_ds, class_names = self._load_data(sweep=configs)
+        trainer = SweepTrainer(len(class_names), configs, precision=self.precision,
+                               device_augment=self.augment == 'device', mixup_alpha=self.mixup_alpha,
+                               cutmix_alpha=self.cutmix_alpha)
+        n = trainer.num_replicas
+        logger.info(f"Sweeping {n} configs in one vmapped train step")
+        rng, init_rng = jax.random.split(jax.random.PRNGKey(int(time.time())))
+        states = trainer.create_state(init_rng, input_shape=(1, self.img_size, self.img_size, 3))
+        best_states = states
+        train_batches = self._get_num_batches(train_ds)
+        best_val_acc = np.zeros(n)
+        best_epoch = np.zeros(n, dtype=int)
+        stale = np.zeros(n, dtype=int)
+        active = np.ones(n, dtype=bool)
+        history = [{'train_loss': [], 'train_acc': [], 'val_loss': [], 'val_acc': []} for _ in range(n)]
+        start_time = time.time()
+        for epoch in range(self.epochs):
+            epoch_start = time.time()
+            train_iter = iter(loader.train_dataset(epoch).as_numpy_iterator())
+            train_sums = init_metric_sums()
+            for _ in range(train_batches):
+                step_rng, rng = jax.random.split(rng)
+                states, metrics = trainer.train_step(states, next(train_iter), step_rng, active)
+                train_sums = accumulate_metrics(train_sums, metrics)
+            val_sums = init_metric_sums()
+            for batch in val_ds.as_numpy_iterator():
+                val_sums = accumulate_metrics(val_sums, trainer.eval_step(states, batch))
+            train_sums, val_sums = jax.device_get((train_sums, val_sums))
+            val_acc = val_sums['acc'] / max(int(val_sums['count']), 1)
+            improved = active & (val_acc > best_val_acc)
+            if improved.any():
+                best_states = SweepTrainer.keep_best(improved, states, best_states)
+            for i in range(n):
+                if not active[i]:
+                    continue
+                for key, sums in (('train', train_sums), ('val', val_sums)):
+                    for metric in ('loss', 'acc'):
+                        history[i][f'{key}_{metric}'].append(float(sums[metric][i]) / max(int(sums['count']), 1))
+                if improved[i]:
+                    best_val_acc[i], best_epoch[i], stale[i] = val_acc[i], epoch + 1, 0
+                else:
+                    stale[i] += 1
+            logger.info(f"Epoch {epoch+1}/{self.epochs} ({time.time() - epoch_start:.1f}s) | " + " | ".join(
+                f"#{i} val {history[i]['val_acc'][-1]:.3f} best {best_val_acc[i]:.3f}{'' if active[i] else ' (stopped)'}"
+                for i in range(n)))
+            active &= stale < self.patience
+            if not active.any():
+                logger.info(f"All replicas early-stopped after {epoch+1} epochs")
+                break
+            if time.time() - start_time > self.max_time:
+                logger.info(f"Time limit of {self.max_time}s reached after {epoch+1} epochs")
+                break
 
-    def preprocess_image(self, image_path):
-        img = tf.io.read_file(image_path)
-        img = tf.image.decode_image(img, channels=3)
-        img = tf.image.resize(img, [self.img_size, self.img_size])
-        img = tf.cast(img, tf.float32) / 255.0
-        return img[tf.newaxis, ...]
-
-    @jax.jit
-    def predict_single(self, params, image):
-        logits = self.state.apply_fn({'params': params}, image, training=False)
-        probs = jax.nn.softmax(logits)
-        return probs
-
-    def predict(self, image_path):
-        try:
-            import matplotlib.pyplot as plt
-            img = self.preprocess_image(image_path)
-            probs = self.predict_single(self.state.params, img)
-            pred_class = jnp.argmax(probs[0])
-            pred_prob = probs[0][pred_class]
-            plt.figure(figsize=(6, 8))
-            plt.subplot(2, 1, 1)
-            plt.imshow(img[0])
-            plt.title(f"Prediction: {self.class_names[pred_class]} ({pred_prob:.2%})")
-            plt.axis('off')
-            plt.subplot(2, 1, 2)
-            indices = jnp.argsort(probs[0])[::-1]
-            top_k = 5 if len(self.class_names) >= 5 else len(self.class_names)
-            bars = plt.barh(range(top_k), [probs[0][i] for i in indices[:top_k]], color='skyblue')
-            plt.yticks(range(top_k), [self.class_names[i] for i in indices[:top_k]])
-            plt.xlabel('Probability')
-            plt.title('Top Predictions')
-            for i, bar in enumerate(bars):
-                plt.text(bar.get_width() + 0.01, bar.get_y() + bar.get_height()/2,
-                         f'{probs[0][indices[i]]:.2%}', va='center')
-            plt.tight_layout()
-            plt.show()
-            return self.class_names[pred_class], pred_prob
-        except ImportError:
-            logger.warning("Matplotlib not available, returning prediction only")
-            img = self.preprocess_image(image_path)
-            probs = self.predict_single(self.state.params, img)
-            pred_class = jnp.argmax(probs[0])
-            pred_prob = probs[0][pred_class]
-            return self.class_names[pred_class], pred_prob
+        os.makedirs(output_dir, exist_ok=True)
+        results = []
+        for i, config in enumerate(trainer.configs):
+            path = os.path.join(output_dir, f"replica_{i:02d}.flax")
+            export_inference_artifact(path, SweepTrainer.replica(best_states, i), class_names,
+                                      img_size=self.img_size, dropout_rate=config['dropout_rate'],
+                                      precision=self.precision)
+            results.append({'replica': i, 'config': config, 'best_val_acc': float(best_val_acc[i]),
+                            'best_epoch': int(best_epoch[i]), 'epochs_trained': len(history[i]['val_acc']),
+                            'artifact': path, 'history': history[i]})
+        results.sort(key=lambda r: -r['best_val_acc'])
+        with open(os.path.join(output_dir, "results.json"), "w") as f:
+            json.dump({'total_time': time.time() - start_time, 'results': results}, f, indent=2)
+        logger.info(f"Sweep finished in {time.time() - start_time:.1f}s; best: {results[0]['config']} "
+                    f"(val acc {results[0]['best_val_acc']:.4f})")
+        return results
 
 # ------------------------------
 # Main Execution
 # ------------------------------
-if __name__ == "__main__":
+SHARD_PATH = os.path.join(PROJECT_ROOT, "dataset_shards")
+
+def run_training(shard_dir=None, resume=False, profile=False, trace_dir=None, trace_steps=(10, 20)):
     try:
-        # Use a local dataset directory relative to the project root
-        DATA_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "dataset")
         os.makedirs(DATA_PATH, exist_ok=True)
+        augment = os.environ.get("AGRIVISION_AUGMENT", "tf")  # tf | device | none
         pipeline = TurboPipeline(
             data_dir=DATA_PATH,
             img_size=128,
             batch_size=64,    # Adjust if needed based on GPU memory
             epochs=50,
             patience=1000,    # Set a very high patience to disable early stopping
-            max_time=7200     # Ensure max_time is sufficiently high or set even higher if needed
+            max_time=7200,    # Ensure max_time is sufficiently high or set even higher if needed
+            compilation_cache_dir=os.environ.get("AGRIVISION_COMPILATION_CACHE_DIR"),
+            data_parallel=os.environ.get("AGRIVISION_DATA_PARALLEL", "0") == "1",
+            num_cpu_devices=int(os.environ.get("AGRIVISION_CPU_DEVICES", 0)) or None,
+            steps_per_call=int(os.environ.get("AGRIVISION_STEPS_PER_CALL", 1)),
+            dataset_cache=os.environ.get("AGRIVISION_DATASET_CACHE"),
+            shard_dir=shard_dir,
+            precision=os.environ.get("AGRIVISION_PRECISION", "float32"),
+            resume=resume,
+            profile=profile,
+            trace_dir=trace_dir,
+            trace_steps=trace_steps,
+            augment=None if augment == "none" else augment,
+            mixup_alpha=float(os.environ.get("AGRIVISION_MIXUP_ALPHA", 0)),
+            cutmix_alpha=float(os.environ.get("AGRIVISION_CUTMIX_ALPHA", 0)),
+            checkpoint_every=int(os.environ.get("AGRIVISION_CHECKPOINT_EVERY", 0)),
+            parity_baseline=os.environ.get("AGRIVISION_PARITY_BASELINE")
         )
 
         final_state, classes = pipeline.run()
 
-        # Save the final model to a file in the DATA_PATH so you can use it later without re-running training.
+        # Save a self-contained inference artifact so serving never needs the dataset or optimizer.
         final_model_path = os.path.join(DATA_PATH, "final_model.flax")
-        from flax import serialization
-        with open(final_model_path, "wb") as f:
-            f.write(serialization.to_bytes(final_state.params))
-        logger.info(f"Final model saved to {final_model_path}")
+        export_inference_artifact(final_model_path, final_state, classes, img_size=pipeline.img_size,
+                                  dropout_rate=pipeline.dropout_rate, precision=pipeline.precision)
 
         # Example: To make a prediction, update the image path and uncomment below:
-        # inference = ModelInference(final_state, classes)
+        # inference = load_inference_artifact(final_model_path)
         # predicted_class, confidence = inference.predict("/content/drive/MyDrive/TS- GBC -1/Dataset/Tomato_Bacterial_spot/00416648-be6e-4bd4-bc8d-82f43f8a7240___GCREC_Bact.Sp 3110.JPG")
         # print(f"Predicted class: {predicted_class} with {confidence:.2%} confidence")
     except Exception as e:
         logger.exception("An error occurred during pipeline execution:")
 
-app = FastAPI()
-
-# Enable CORS (Cross-Origin Resource Sharing)
-origins = [
-    "http://localhost:5173",  # Your React app's development URL
-    "http://localhost:8000", # Your backend url
-    # Add other origins if needed (e.g., productionURL)
-]
-
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=origins,
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-# Load the model (only once at startup)
-# Use a local dataset directory relative to the project root
-DATA_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "dataset")
-os.makedirs(DATA_PATH, exist_ok=True)
-try:
-    # Check if the model exists
-    final_model_path = os.path.join(DATA_PATH, "final_model.flax")
-    if not os.path.exists(final_model_path):
-        logger.info("Model not found, training a new one...")
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="AgriVision 360 crop disease model")
+    commands = parser.add_subparsers(dest="command")
+    train = commands.add_parser("train", help="Train the model and export final_model.flax (default)")
+    train.add_argument("--shard-dir", default=os.environ.get("AGRIVISION_SHARD_DIR"),
+                       help="Train from ingested shards instead of the image directory")
+    train.add_argument("--resume", action="store_true", help="Continue from the latest checkpoint")
+    train.add_argument("--profile", action="store_true",
+                       help="Log a per-epoch data wait / host-to-device / compute breakdown")
+    train.add_argument("--trace-dir", default=None, help="Capture a jax.profiler trace into this directory")
+    train.add_argument("--trace-steps", default="10:20", help="START:STOP global train steps to trace")
+    ingest = commands.add_parser("ingest", help="Decode the image directory once into uint8 .npy shards")
+    ingest.add_argument("--data-dir", default=DATA_PATH)
+    ingest.add_argument("--shard-dir", default=SHARD_PATH)
+    ingest.add_argument("--img-size", type=int, default=128)
+    ingest.add_argument("--shard-size", type=int, default=4096, help="Images per shard")
+    ingest.add_argument("--workers", type=int, default=None, help="Decode threads (default: all cores)")
+    ingest.add_argument("--rebuild", action="store_true", help="Ignore the existing index and re-ingest everything")
+    ingest.add_argument("--min-live-fraction", type=float, default=0.5,
+                        help="Repack shards whose share of still-indexed images drops below this")
+    quantize = commands.add_parser("quantize", help="Export an int8 copy of final_model.flax")
+    quantize.add_argument("--model", default=os.path.join(DATA_PATH, "final_model.flax"))
+    quantize.add_argument("--output", default=os.path.join(DATA_PATH, "final_model_int8.flax"))
+    quantize.add_argument("--data-dir", default=DATA_PATH)
+    quantize.add_argument("--shard-dir", default=None, help="Read the validation split from ingested shards")
+    quantize.add_argument("--calibration-size", type=int, default=256,
+                          help="Validation images used to calibrate activation scales")
+    score = commands.add_parser("score", help="Batch-score a directory or file list of images")
+    score.add_argument("source", help="Image directory (searched recursively) or a text file of paths")
+    score.add_argument("--model", default=os.path.join(DATA_PATH, "final_model.flax"))
+    score.add_argument("--output", default="predictions.csv", help="CSV, or JSONL for .jsonl/.json; appended to")
+    score.add_argument("--batch-size", type=int, default=BATCH_BUCKETS[-1])
+    score.add_argument("--workers", type=int, default=None, help="Decode threads (default: all cores)")
+    score.add_argument("--top-k", type=int, default=5)
+    sweep = commands.add_parser("sweep", help="Train every lr x weight decay x dropout combination in one vmapped run")
+    sweep.add_argument("--lr", type=float, nargs="+", default=[1e-3])
+    sweep.add_argument("--weight-decay", type=float, nargs="+", default=[1e-4])
+    sweep.add_argument("--dropout-rate", type=float, nargs="+", default=[0.2])
+    sweep.add_argument("--epochs", type=int, default=50)
+    sweep.add_argument("--patience", type=int, default=5, help="Per-replica early stopping patience (epochs)")
+    sweep.add_argument("--shard-dir", default=os.environ.get("AGRIVISION_SHARD_DIR"))
+    sweep.add_argument("--output-dir", default=os.path.join(PROJECT_ROOT, "sweep"))
+    args = parser.parse_args(argv)
+
+    if args.command == "sweep":
+        configs = [{'lr': lr, 'weight_decay': wd, 'dropout_rate': dr}
+                   for lr in args.lr for wd in args.weight_decay for dr in args.dropout_rate]
+        augment = os.environ.get("AGRIVISION_AUGMENT", "tf")
         pipeline = TurboPipeline(
-            data_dir=DATA_PATH,
-            img_size=128,
-            batch_size=64,
-            epochs=50,
-            patience=1000,
-            max_time=7200
-        )
-        final_state, classes = pipeline.run()
-        # Save the model
-        from flax import serialization
-        with open(final_model_path, "wb") as f:
-            f.write(serialization.to_bytes(final_state.params))
-        logger.info(f"Final model saved to {final_model_path}")
+            DATA_PATH, img_size=128, batch_size=64, epochs=args.epochs, patience=args.patience,
+            compilation_cache_dir=os.environ.get("AGRIVISION_COMPILATION_CACHE_DIR"),
+            dataset_cache=os.environ.get("AGRIVISION_DATASET_CACHE"), shard_dir=args.shard_dir,
+            precision=os.environ.get("AGRIVISION_PRECISION", "float32"),
+            augment=None if augment == "none" else augment,
+            mixup_alpha=float(os.environ.get("AGRIVISION_MIXUP_ALPHA", 0)),
+            cutmix_alpha=float(os.environ.get("AGRIVISION_CUTMIX_ALPHA", 0)))
+        results = pipeline.sweep(configs, args.output_dir)
+        print(json.dumps([{k: r[k] for k in ('replica', 'config', 'best_val_acc', 'best_epoch')}
+                          for r in results], indent=2))
+    elif args.command == "score":
+        report = score_images(args.model, args.source, args.output, batch_size=args.batch_size,
+                              workers=args.workers, top_k=args.top_k)
+        print(json.dumps(report, indent=2))
+    elif args.command == "quantize":
+        with open(args.model, "rb") as f:
+            img_size = serialization.msgpack_restore(f.read())['img_size']
+        loader = TurboDataLoader(args.data_dir, img_size, augment=False, shard_dir=args.shard_dir)
+        _, val_ds, _ = loader.load()
+        report = quantize_artifact(args.model, args.output, val_ds, calibration_size=args.calibration_size)
+        print(json.dumps(report, indent=2))
+    elif args.command == "ingest":
+        ingest_dataset(args.data_dir, args.shard_dir, img_size=args.img_size,
+                       shard_size=args.shard_size, workers=args.workers, rebuild=args.rebuild,
+                       min_live_fraction=args.min_live_fraction)
     else:
-        logger.info("Loading existing model...")
-        # Load the model
-        from flax import serialization
-        with open(final_model_path, "rb") as f:
-            model_params = serialization.from_bytes(None, f.read())
-        # Create a dummy state to load the model
-        pipeline = TurboPipeline(
-            data_dir=DATA_PATH,
-            img_size=128,
-            batch_size=64,
-            epochs=50,
-            patience=1000,
-            max_time=7200
-        )
-        loader = TurboDataLoader(
-            DATA_PATH,
-            128,
-            64,
-            augment=True
-        )
-        _, _, class_names = loader.load()
-        trainer = SpeedTrainer(num_classes=len(class_names), dropout_rate=0.2)
-        rng = jax.random.PRNGKey(int(time.time()))
-        state = trainer.create_state(rng, input_shape=(1, 128, 128, 3))
-        final_state = state.replace(params=model_params)
-        classes = class_names
-    inference = ModelInference(final_state, classes)
-    logger.info("Model loaded successfully.")
-except Exception as e:
-    logger.error(f"Error loading model: {e}")
-    raise
-
-@app.post("/predict/")
-async def predict(file: UploadFile = File(...)):
-    try:
-        # Read the image file
-        image_data = await file.read()
-        image = Image.open(io.BytesIO(image_data))
-        image = image.convert("RGB")  # Ensure it's RGB
-        image.save("temp.jpg")
-        # Make a prediction
-        predicted_class, confidence = inference.predict("temp.jpg")
-        os.remove("temp.jpg")
-        return {
-            "class": predicted_class,
-            "confidence": confidence,
-        }
-    except Exception as e:
-        logger.error(f"Error during prediction: {e}")
-        raise HTTPException(status_code=500, detail="Prediction failed")
+        trace_start, trace_stop = (int(n) for n in getattr(args, "trace_steps", "10:20").split(":"))
+        run_training(shard_dir=getattr(args, "shard_dir", None), resume=getattr(args, "resume", False),
+                     profile=getattr(args, "profile", False), trace_dir=getattr(args, "trace_dir", None),
+                     trace_steps=(trace_start, trace_stop))
 
-@app.get("/classes/")
-async def get_classes():
-    return {"classes": inference.class_names}
+def __getattr__(name):
+    # `uvicorn main:app` keeps working; the server itself lives in serving.py and is only
+    # imported when asked for, so training never pulls in FastAPI.
+    if name == "app":
+        from serving import app
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,683 @@
+import os
+import io
+import csv
+import json
+import time
+import hashlib
+import logging
+import threading
+import functools
+import collections
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable
+
+# Serving-side model code: the network, artifact I/O, quantization and batched inference.
+# Only JAX/Flax, NumPy and Pillow are imported here, so an API worker never loads TensorFlow,
+# optax or the notebook tooling that training needs (those live in main.py).
+import jax
+import jax.numpy as jnp
+import flax.linen as nn
+from flax import struct
+from flax import serialization
+from PIL import Image
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Use a local dataset directory relative to the project root
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_PATH = os.path.join(PROJECT_ROOT, "dataset")
+
+# ------------------------------
+# Persistent XLA Compilation Cache
+# ------------------------------
+_compilation_cache_stats = {'hits': 0, 'misses': 0}
+_compilation_cache_listening = False
+
+def _count_compilation_cache_event(event, **kwargs):
+    if event == '/jax/compilation_cache/cache_hits':
+        _compilation_cache_stats['hits'] += 1
+    elif event == '/jax/compilation_cache/cache_misses':
+        _compilation_cache_stats['misses'] += 1
+
+def enable_compilation_cache(cache_dir, **key_parts):
+    """Persist compiled XLA executables under a directory keyed by backend, JAX version and ``key_parts``."""
+    global _compilation_cache_listening
+    backend = jax.default_backend()
+    key = json.dumps({'backend': backend, 'jax': jax.__version__, **key_parts},
+                     sort_keys=True, default=str)
+    path = os.path.join(os.path.abspath(cache_dir),
+                        f"{backend}-{hashlib.sha1(key.encode()).hexdigest()[:12]}")
+    os.makedirs(path, exist_ok=True)
+    jax.config.update("jax_compilation_cache_dir", path)
+    # Cache everything: even the sub-second compiles add up at startup.
+    jax.config.update("jax_persistent_cache_min_compile_time_secs", 0)
+    jax.config.update("jax_persistent_cache_min_entry_size_bytes", 0)
+    if not _compilation_cache_listening:
+        jax.monitoring.register_event_listener(_count_compilation_cache_event)
+        _compilation_cache_listening = True
+    logger.info(f"Persistent compilation cache enabled at {path}")
+    return path
+
+def compilation_cache_stats():
+    return dict(_compilation_cache_stats)
+
+# ------------------------------
+# Improved CNN Model with BatchNorm and Dropout
+# ------------------------------
+# Compute dtype per precision policy. Parameters, BatchNorm statistics, logits and the loss are
+# always float32; "bfloat16" runs activations and convolutions in bfloat16 (mixed precision).
+PRECISION_POLICIES = {
+    'float32': jnp.float32,
+    'bfloat16': jnp.bfloat16,
+}
+
+class FastVisionModel(nn.Module):
+    num_classes: int
+    dropout_rate: float = 0.2
+    precision: str = 'float32'
+
+    @nn.compact
+    def __call__(self, x, training=True, dropout_rate=None):
+        dtype = PRECISION_POLICIES[self.precision]
+        # Normalize input to [-1, 1]
+        x = ((x - 0.5) * 2.0).astype(dtype)
+
+        # Stem block
+        x = nn.Conv(32, (3, 3), strides=2, padding='SAME', dtype=dtype)(x)
+        x = nn.relu(x)
+        x = nn.BatchNorm(use_running_average=not training, dtype=dtype)(x)
+
+        # Main blocks with residual connections
+        for filters in [64, 128, 256]:
+            residual = x
+            x = self._ds_block(x, filters, training, dtype)
+            if residual.shape[-1] == x.shape[-1] and residual.shape[1:3] == x.shape[1:3]:
+                x = x + residual
+
+        # Global pooling and classification head
+        x = jnp.mean(x, axis=(1, 2))
+        if training:
+            x = self._dropout(x, dropout_rate)
+        x = nn.Dense(features=512, dtype=dtype)(x)
+        x = nn.relu(x)
+        if training:
+            x = self._dropout(x, dropout_rate)
+        x = nn.Dense(features=self.num_classes, dtype=dtype)(x)
+        return x.astype(jnp.float32)
+
+    def _dropout(self, x, rate):
+        if rate is None:
+            return nn.Dropout(rate=self.dropout_rate)(x, deterministic=False)
+        # A traced rate (one per replica in SweepTrainer): nn.Dropout needs a concrete one.
+        keep = 1.0 - rate
+        mask = jax.random.bernoulli(self.make_rng('dropout'), keep, x.shape)
+        return jnp.where(mask, x / keep, 0).astype(x.dtype)
+
+    def _ds_block(self, x, filters, training, dtype):
+        x = nn.Conv(features=x.shape[-1], kernel_size=(3, 3),
+                    feature_group_count=x.shape[-1], padding='SAME', dtype=dtype)(x)
+        x = nn.Conv(features=filters, kernel_size=(1, 1), padding='SAME', dtype=dtype)(x)
+        x = nn.relu(x)
+        x = nn.BatchNorm(use_running_average=not training, dtype=dtype)(x)
+        x = nn.max_pool(x, window_shape=(2, 2), strides=(2, 2), padding='SAME')
+        return x
+
+def load_parity_baseline(path, class_names):
+    """Variables of a float32-trained artifact, checked to use exactly ``class_names`` in that label order."""
+    with open(path, "rb") as f:
+        baseline = serialization.msgpack_restore(f.read())
+    if baseline['model_config'].get('precision', 'float32') != 'float32' or baseline.get('quantized'):
+        raise ValueError(f"{path} is not a float32-trained artifact")
+    if list(baseline['class_names']) != list(class_names):
+        raise ValueError(f"{path} classes {list(baseline['class_names'])} differ from "
+                         f"{list(class_names)} (same classes in the same label order are required)")
+    return {'params': baseline['params'], 'batch_stats': baseline['batch_stats']}
+
+def precision_parity(variables, class_names, dataset, precision='bfloat16', dropout_rate=0.2,
+                     baseline_path=None):
+    """Compare ``variables`` in ``precision`` with float32-trained ``baseline_path`` (default: themselves in float32)."""
+    reference = variables if baseline_path is None else load_parity_baseline(baseline_path, class_names)
+    correct = {'float32': 0, precision: 0}
+    agree = total = 0
+    applies = {p: jax.jit(functools.partial(
+                   FastVisionModel(len(class_names), dropout_rate, precision=p).apply, training=False))
+               for p in correct}
+    weights = {'float32': reference, precision: variables}
+    for images, labels in dataset.as_numpy_iterator():
+        images = as_float_images(images)
+        preds = {p: np.asarray(jnp.argmax(apply(weights[p], images), axis=-1)) for p, apply in applies.items()}
+        for p in correct:
+            correct[p] += int(np.sum(preds[p] == labels))
+        agree += int(np.sum(preds['float32'] == preds[precision]))
+        total += len(labels)
+    total = max(total, 1)
+    return {
+        'float32_acc': correct['float32'] / total,
+        f'{precision}_acc': correct[precision] / total,
+        'accuracy_delta': (correct[precision] - correct['float32']) / total,
+        'agreement': agree / total,
+        'reference': 'float32-trained baseline' if baseline_path else 'same weights in float32',
+    }
+
+def as_float_images(images):
+    """uint8 [0, 255] batches (device augmentation mode) -> float32 [0, 1]; float batches pass through."""
+    if images.dtype == jnp.uint8:
+        return images.astype(jnp.float32) / 255.0
+    return images
+
+# ------------------------------
+# Inference Artifact
+# ------------------------------
+def _atomic_write(path, data):
+    """Write-then-rename so readers never observe a partially written file."""
+    path = Path(path)
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+ARTIFACT_FORMAT_VERSION = 1
+
+@struct.dataclass
+class InferenceState:
+    """Everything the forward pass needs: no optimizer state, no dataset."""
+    apply_fn: Callable = struct.field(pytree_node=False)
+    params: Any
+    batch_stats: Any
+
+def export_inference_artifact(path, state, class_names, img_size=128, dropout_rate=0.2, precision='float32'):
+    """Write a self-contained serving bundle: weights, BatchNorm statistics, classes and model config."""
+    bundle = {
+        'format_version': ARTIFACT_FORMAT_VERSION,
+        'params': serialization.to_state_dict(jax.device_get(state.params)),
+        'batch_stats': serialization.to_state_dict(jax.device_get(state.batch_stats)),
+        'class_names': list(class_names),
+        'img_size': img_size,
+        'model_config': {'num_classes': len(class_names), 'dropout_rate': dropout_rate,
+                         'precision': precision},
+    }
+    _atomic_write(path, serialization.msgpack_serialize(bundle))
+    logger.info(f"Inference artifact saved to {path}")
+
+def load_inference_artifact(path, precision=None, **kwargs):
+    """Build a ready-to-serve ModelInference (``version`` = content hash) from an exported artifact."""
+    with open(path, "rb") as f:
+        data = f.read()
+    bundle = serialization.msgpack_restore(data)
+    if 'format_version' not in bundle:
+        raise ValueError(f"{path} is a legacy params-only checkpoint; re-export it with "
+                         "export_inference_artifact() so it carries batch_stats and class names")
+    model_config = dict(bundle['model_config'])
+    if bundle.get('quantized'):
+        # BatchNorm is already folded into the int8 weights: no batch_stats, fixed precision.
+        state = InferenceState(apply_fn=quantized_apply, params=bundle['params'], batch_stats={})
+        model_config['quantized'] = bundle['quantized']  # 'int8', 'weight_only' (True: older int8)
+    else:
+        if precision:
+            model_config['precision'] = precision
+        model = FastVisionModel(**model_config)
+        state = InferenceState(apply_fn=model.apply, params=bundle['params'],
+                               batch_stats=bundle['batch_stats'])
+    return ModelInference(state, bundle['class_names'], img_size=bundle['img_size'],
+                          model_config=model_config, version=hashlib.blake2b(data, digest_size=6).hexdigest(),
+                          **kwargs)
+
+# ------------------------------
+# Int8 Post-Training Quantization
+# ------------------------------
+# FastVisionModel's parameter layout: stem conv + BN, three (depthwise, pointwise, BN) blocks, two
+# dense layers. Pointwise convs and dense layers run as int8 x int8 -> int32; the stem (3 input
+# channels) and depthwise convs keep int8 storage but compute in float32. Where int8 compute is
+# not faster than float on the host, artifacts fall back to weight-only int8 (all layers
+# dequantize their int8 kernels and compute in float32).
+_STEM = ('Conv_0', 'BatchNorm_0')
+_DS_BLOCKS = (('Conv_1', 'Conv_2', 'BatchNorm_1'),
+              ('Conv_3', 'Conv_4', 'BatchNorm_2'),
+              ('Conv_5', 'Conv_6', 'BatchNorm_3'))
+_INT8_COMPUTE_LAYERS = ('Conv_2', 'Conv_4', 'Conv_6', 'Dense_0', 'Dense_1')
+
+def fold_batchnorm(params, batch_stats, eps=1e-5):
+    """Fold each ``conv -> relu -> BatchNorm`` into the conv, leaving a per-channel sign and shift."""
+    # BN follows the ReLU: s * relu(z) + t == sign(s) * relu(|s| * z) + t, so |s| moves into the conv.
+    folded = {name: dict(layer) for name, layer in params.items() if not name.startswith('BatchNorm')}
+    for conv, bn in [_STEM] + [(pointwise, bn) for _, pointwise, bn in _DS_BLOCKS]:
+        scale = params[bn]['scale'] / np.sqrt(batch_stats[bn]['var'] + eps)
+        folded[conv] = {'kernel': params[conv]['kernel'] * np.abs(scale),
+                        'bias': params[conv]['bias'] * np.abs(scale)}
+        folded[bn] = {'sign': np.sign(scale).astype(np.float32),
+                      'shift': params[bn]['bias'] - batch_stats[bn]['mean'] * scale}
+    return jax.tree_util.tree_map(lambda x: np.asarray(x, dtype=np.float32), folded)
+
+def _layer(p, x, strides=(1, 1), groups=1, conv=True):
+    """Conv or dense layer for float, int8-storage or int8-compute parameters."""
+    preferred = None
+    if 'act_scale' in p:
+        x = jnp.clip(jnp.round(x / p['act_scale']), -127, 127).astype(jnp.int8)
+        kernel, preferred = p['qkernel'], jnp.int32
+    elif 'qkernel' in p:
+        kernel = p['qkernel'].astype(jnp.float32) * p['kscale']
+    else:
+        kernel = p['kernel']
+    if conv:
+        y = jax.lax.conv_general_dilated(x, kernel, strides, 'SAME', feature_group_count=groups,
+                                         dimension_numbers=('NHWC', 'HWIO', 'NHWC'),
+                                         preferred_element_type=preferred)
+    else:
+        y = jax.lax.dot_general(x, kernel, (((x.ndim - 1,), (0,)), ((), ())),
+                                preferred_element_type=preferred)
+    if 'act_scale' in p:
+        y = y.astype(jnp.float32) * (p['act_scale'] * p['kscale'])
+    return y + p['bias']
+
+def _folded_forward(p, x, collect=False):
+    """Eval-mode forward pass on folded (optionally quantized) parameters, plus calibration maxima if ``collect``."""
+    maxima = {}
+    def track(name, x):
+        if collect:
+            maxima[name] = jnp.max(jnp.abs(x))
+        return x
+
+    x = (x - 0.5) * 2.0
+    conv, bn = _STEM
+    x = nn.relu(_layer(p[conv], x, strides=(2, 2))) * p[bn]['sign'] + p[bn]['shift']
+    for depthwise, pointwise, bn in _DS_BLOCKS:
+        residual = x
+        x = _layer(p[depthwise], x, groups=x.shape[-1])
+        x = nn.relu(_layer(p[pointwise], track(pointwise, x))) * p[bn]['sign'] + p[bn]['shift']
+        x = nn.max_pool(x, window_shape=(2, 2), strides=(2, 2), padding='SAME')
+        if residual.shape == x.shape:
+            x = x + residual
+    x = jnp.mean(x, axis=(1, 2))
+    x = nn.relu(_layer(p['Dense_0'], track('Dense_0', x), conv=False))
+    x = _layer(p['Dense_1'], track('Dense_1', x), conv=False)
+    return (x, maxima) if collect else x
+
+def quantized_apply(variables, images, training=False):
+    """``model.apply``-compatible entry point for quantized artifacts."""
+    return _folded_forward(variables['params'], images)
+
+def quantize_params(folded, calibration_images, batch_size=32):
+    """Per-output-channel symmetric int8 weights plus calibrated per-tensor activation scales."""
+    collect = jax.jit(functools.partial(_folded_forward, collect=True))
+    maxima = {}
+    for start in range(0, len(calibration_images), batch_size):
+        _, batch_maxima = jax.device_get(collect(folded, calibration_images[start:start + batch_size]))
+        for name, value in batch_maxima.items():
+            maxima[name] = max(maxima.get(name, 0.0), float(value))
+    quantized = {}
+    for name, layer in folded.items():
+        if 'kernel' not in layer:
+            quantized[name] = layer
+            continue
+        kernel = layer['kernel']
+        kscale = np.max(np.abs(kernel.reshape(-1, kernel.shape[-1])), axis=0) / 127.0
+        kscale = np.where(kscale == 0, 1.0, kscale).astype(np.float32)
+        quantized[name] = {'qkernel': np.clip(np.round(kernel / kscale), -127, 127).astype(np.int8),
+                           'kscale': kscale, 'bias': layer['bias']}
+        if name in _INT8_COMPUTE_LAYERS:
+            quantized[name]['act_scale'] = np.float32(max(maxima[name], 1e-8) / 127.0)
+    return quantized
+
+def weight_only(qparams):
+    """Drop the activation scales so every layer dequantizes its int8 kernel and computes in float32."""
+    return {name: {k: v for k, v in layer.items() if k != 'act_scale'} for name, layer in qparams.items()}
+
+def calibration_sample(dataset, size=256, seed=0):
+    """Uniform random ``size`` images from one pass over ``dataset`` (reservoir sampling)."""
+    rng = np.random.default_rng(seed)  # not a prefix: splits are often stored class by class
+    sample, seen = [], 0
+    for images, _ in dataset.as_numpy_iterator():
+        for image in images:
+            if len(sample) < size:
+                sample.append(image)
+            else:
+                slot = rng.integers(0, seen + 1)
+                if slot < size:
+                    sample[slot] = image
+            seen += 1
+    return as_float_images(np.stack(sample))
+
+def _time_forward(fn, params, batch_size, img_size, repeats=20):
+    images = np.random.RandomState(0).rand(batch_size, img_size, img_size, 3).astype(np.float32)
+    jax.block_until_ready(fn(params, images))
+    start = time.perf_counter()
+    for _ in range(repeats):
+        jax.block_until_ready(fn(params, images))
+    return (time.perf_counter() - start) / repeats * 1000
+
+def quantize_artifact(model_path, output_path, dataset, calibration_size=256, seed=0,
+                      benchmark_batch_sizes=(1, 8, 32)):
+    """Export an int8 (or weight-only int8, if faster) artifact and report accuracy, latency and size."""
+    with open(model_path, "rb") as f:
+        bundle = serialization.msgpack_restore(f.read())
+    model = FastVisionModel(**bundle['model_config'])
+    variables = {'params': bundle['params'], 'batch_stats': bundle['batch_stats']}
+    qparams = quantize_params(fold_batchnorm(bundle['params'], bundle['batch_stats']),
+                              calibration_sample(dataset, calibration_size, seed))
+    candidates = {'int8': qparams, 'weight_only': weight_only(qparams)}
+
+    float_fn = jax.jit(functools.partial(model.apply, training=False))
+    int8_fn = jax.jit(_folded_forward)
+    correct = {'float': 0, 'int8': 0, 'weight_only': 0}
+    agree = {'int8': 0, 'weight_only': 0}
+    total = 0
+    for images, labels in dataset.as_numpy_iterator():
+        images = as_float_images(images)
+        float_preds = np.argmax(np.asarray(float_fn(variables, images)), axis=-1)
+        correct['float'] += int(np.sum(float_preds == labels))
+        for mode, params in candidates.items():
+            preds = np.argmax(np.asarray(int8_fn(params, images)), axis=-1)
+            correct[mode] += int(np.sum(preds == labels))
+            agree[mode] += int(np.sum(preds == float_preds))
+        total += len(labels)
+    total = max(total, 1)
+
+    latency = {str(bs): {'float': _time_forward(float_fn, variables, bs, bundle['img_size']),
+                         **{mode: _time_forward(int8_fn, params, bs, bundle['img_size'])
+                            for mode, params in candidates.items()}}
+               for bs in benchmark_batch_sizes}
+    int8_wins = sum(t['int8'] for t in latency.values()) < sum(t['float'] for t in latency.values())
+    mode = 'int8' if int8_wins else 'weight_only'
+
+    quantized_bundle = dict(bundle, params=candidates[mode], batch_stats={}, quantized=mode)
+    data = serialization.msgpack_serialize(quantized_bundle)
+    _atomic_write(output_path, data)
+    param_bytes = lambda tree: sum(np.asarray(x).nbytes for x in jax.tree_util.tree_leaves(tree))
+    report = {
+        'mode': mode,
+        'float_acc': correct['float'] / total,
+        'int8_acc': correct[mode] / total,
+        'agreement': agree[mode] / total,
+        'accuracy': {k: v / total for k, v in correct.items()},
+        'float_artifact_bytes': os.path.getsize(model_path),
+        'int8_artifact_bytes': len(data),
+        'float_param_bytes': param_bytes(variables),
+        'int8_param_bytes': param_bytes(candidates[mode]),
+        'latency_ms': latency,
+    }
+    report['accuracy_delta'] = report['int8_acc'] - report['float_acc']
+    logger.info(f"Quantized artifact saved to {output_path}: {report}")
+    return report
+
+# ------------------------------
+# Model Inference and Visualization
+# ------------------------------
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.gif'}
+
+def sniff_image(data):
+    """Parse only the header of raw image bytes (``format`` and ``size``) without decoding pixels."""
+    return Image.open(io.BytesIO(data))
+
+def open_image(data, img_size=128):
+    """Decode image bytes, a ``sniff_image`` result or a uint8 array into a PIL image (JPEG draft when shrinking)."""
+    if isinstance(data, np.ndarray):
+        return Image.fromarray(np.asarray(data, dtype=np.uint8))
+    image = data if isinstance(data, Image.Image) else sniff_image(data)
+    image.draft("RGB", (img_size, img_size))
+    image.load()
+    return image
+
+def resize_image(image, img_size=128):
+    """PIL image -> (img_size, img_size, 3) uint8 array."""
+    image = image.convert("RGB")
+    if image.size != (img_size, img_size):
+        image = image.resize((img_size, img_size), Image.BILINEAR)
+    return np.asarray(image, dtype=np.uint8)
+
+def decode_image(data, img_size=128):
+    """Decode raw image bytes or an HxWxC uint8 array into an (img_size, img_size, 3) uint8 array."""
+    if isinstance(data, np.ndarray) and data.shape == (img_size, img_size, 3) and data.dtype == np.uint8:
+        return data
+    return resize_image(open_image(data, img_size), img_size)
+
+# Batch sizes the forward pass is compiled for; batches are zero-padded up to the next bucket
+# so XLA sees a handful of fixed shapes instead of recompiling for every batch size.
+BATCH_BUCKETS = (1, 4, 8, 16, 32)
+
+def _bucket_size(n):
+    for bucket in BATCH_BUCKETS:
+        if n <= bucket:
+            return bucket
+    return BATCH_BUCKETS[-1]
+
+class InferenceEngine:
+    """Ahead-of-time compiled forward pass, one executable per batch bucket."""
+    def __init__(self, apply_fn, params, batch_stats, img_size=128, top_k=5):
+        self.img_size = img_size
+        self.top_k = top_k
+        self.variables = jax.device_put({'params': params, 'batch_stats': batch_stats})
+
+        def forward(variables, images):
+            logits = apply_fn(variables, images, training=False)
+            return jax.lax.top_k(jax.nn.softmax(logits), top_k)
+
+        self._jitted = jax.jit(forward)
+        self._compiled = {}
+        self._lock = threading.Lock()
+
+    def compile(self, batch_size):
+        """Lower and compile the forward pass for ``batch_size`` images (no-op when cached)."""
+        with self._lock:
+            if batch_size in self._compiled:
+                return self._compiled[batch_size]
+            start = time.time()
+            spec = jax.ShapeDtypeStruct((batch_size, self.img_size, self.img_size, 3), jnp.float32)
+            compiled = self._jitted.lower(self.variables, spec).compile()
+            cost = compiled.cost_analysis()
+            if isinstance(cost, (list, tuple)):
+                cost = cost[0] if cost else {}
+            flops = (cost or {}).get('flops', 0.0)
+            logger.info(f"Compiled inference bucket {batch_size} in {time.time() - start:.2f}s "
+                        f"({flops / 1e9:.2f} GFLOPs per call)")
+            self._compiled[batch_size] = compiled
+            return compiled
+
+    def __call__(self, images):
+        return self.compile(images.shape[0])(self.variables, images)
+
+class ModelInference:
+    def __init__(self, state, class_names, img_size=128, top_k=5, model_config=None, version=None):
+        self.state = state
+        self.class_names = class_names
+        self.img_size = img_size
+        self.model_config = model_config or {}
+        self.version = version
+        self.top_k = min(top_k, len(class_names))
+        self.engine = InferenceEngine(state.apply_fn, state.params, state.batch_stats,
+                                      img_size=img_size, top_k=self.top_k)
+
+    def predict_batch(self, images):
+        """(N, img_size, img_size, 3) float32 -> top-k (probabilities, class indices), each (N, k)."""
+        images = np.asarray(images, dtype=np.float32)
+        top_probs, top_indices = [], []
+        for start in range(0, len(images), BATCH_BUCKETS[-1]):
+            chunk = images[start:start + BATCH_BUCKETS[-1]]
+            n = len(chunk)
+            padded = np.zeros((_bucket_size(n),) + chunk.shape[1:], dtype=np.float32)
+            padded[:n] = chunk
+            probs, indices = jax.device_get(self.engine(padded))
+            top_probs.append(probs[:n])
+            top_indices.append(indices[:n])
+        return np.concatenate(top_probs, axis=0), np.concatenate(top_indices, axis=0)
+
+    def warmup(self, max_batch_size=BATCH_BUCKETS[-1]):
+        """Compile (and run once) the forward pass for every bucket up to ``max_batch_size``."""
+        for bucket in BATCH_BUCKETS:
+            if bucket > _bucket_size(max_batch_size):
+                break
+            self.engine.compile(bucket)
+            self.predict_batch(np.zeros((bucket, self.img_size, self.img_size, 3), dtype=np.float32))
+
+    def format_predictions(self, top_probs, top_indices):
+        """Turn top-k arrays into JSON-ready dicts with native Python types."""
+        predictions = []
+        for probs, indices in zip(top_probs.tolist(), top_indices.tolist()):
+            predictions.append({
+                "class": self.class_names[indices[0]],
+                "confidence": probs[0],
+                "top_k": [{"class": self.class_names[i], "probability": p}
+                          for i, p in zip(indices, probs)],
+            })
+        return predictions
+
+    def classify(self, images):
+        """Headless batch prediction: class, confidence and top-k for every image."""
+        return self.format_predictions(*self.predict_batch(images))
+
+    def preprocess_bytes(self, data):
+        """Raw upload bytes -> normalized (1, img_size, img_size, 3) float32 batch."""
+        return self.preprocess_array(decode_image(data, self.img_size))
+
+    def preprocess_array(self, image):
+        """HxWxC uint8 array -> normalized (1, img_size, img_size, 3) float32 batch."""
+        img = decode_image(image, self.img_size).astype(np.float32) / 255.0
+        return img[np.newaxis, ...]
+
+    def preprocess_image(self, image):
+        """Accepts a file path, raw encoded bytes or a uint8 array."""
+        if isinstance(image, np.ndarray):
+            return self.preprocess_array(image)
+        if isinstance(image, (bytes, bytearray, memoryview)):
+            return self.preprocess_bytes(bytes(image))
+        with open(image, "rb") as f:
+            return self.preprocess_bytes(f.read())
+
+    def predict(self, image):
+        prediction = self.classify(self.preprocess_image(image))[0]
+        return prediction["class"], prediction["confidence"]
+
+    def plot_prediction(self, image):
+        """Opt-in visualization of a single prediction; never used on the serving path."""
+        try:
+            import matplotlib.pyplot as plt
+        except ImportError:
+            logger.warning("Matplotlib not available, skipping plot")
+            return self.predict(image)
+        img = self.preprocess_image(image)
+        prediction = self.classify(img)[0]
+        top_k = prediction["top_k"]
+        plt.figure(figsize=(6, 8))
+        plt.subplot(2, 1, 1)
+        plt.imshow(img[0])
+        plt.title(f"Prediction: {prediction['class']} ({prediction['confidence']:.2%})")
+        plt.axis('off')
+        plt.subplot(2, 1, 2)
+        bars = plt.barh(range(len(top_k)), [entry["probability"] for entry in top_k], color='skyblue')
+        plt.yticks(range(len(top_k)), [entry["class"] for entry in top_k])
+        plt.xlabel('Probability')
+        plt.title('Top Predictions')
+        for bar, entry in zip(bars, top_k):
+            plt.text(bar.get_width() + 0.01, bar.get_y() + bar.get_height()/2,
+                     f'{entry["probability"]:.2%}', va='center')
+        plt.tight_layout()
+        plt.show()
+        return prediction["class"], prediction["confidence"]
+
+# ------------------------------
+# Bulk Scoring
+# ------------------------------
+def list_images(source):
+    """Image paths under a directory (recursively, sorted) or listed one per line in a text file."""
+    source = Path(source)
+    if source.is_dir():
+        return sorted(str(p) for p in source.rglob('*')
+                      if p.is_file() and p.suffix.lower() in IMAGE_EXTENSIONS)
+    with open(source) as f:
+        return [line.strip() for line in f if line.strip()]
+
+def _scored_paths(output, fmt):
+    """Paths already in ``output``; a partially written last line is cut off first."""
+    if not os.path.exists(output):
+        return set()
+    with open(output, "rb+") as f:
+        data = f.read()
+        complete = data.rfind(b"\n") + 1
+        if complete < len(data):
+            f.truncate(complete)
+    lines = data[:complete].decode().splitlines()
+    if fmt == "jsonl":
+        return {json.loads(line)["path"] for line in lines if line}
+    return {row["path"] for row in csv.DictReader(lines)}
+
+def _read_and_decode(path, img_size):
+    try:
+        with open(path, "rb") as f:
+            return decode_image(f.read(), img_size), None
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+
+def score_images(model_path, source, output, batch_size=BATCH_BUCKETS[-1], workers=None, top_k=5,
+                 prefetch_batches=4):
+    """Score every image from ``source`` into CSV or JSONL, skipping images already in ``output``."""
+    fmt = "jsonl" if output.endswith((".jsonl", ".json")) else "csv"
+    inference = load_inference_artifact(model_path, top_k=top_k)
+    inference.warmup(batch_size)
+    done = _scored_paths(output, fmt)
+    paths = [path for path in list_images(source) if path not in done]
+    logger.info(f"Scoring {len(paths)} images ({len(done)} already in {output})")
+    k = inference.top_k
+    columns = ["path", "class", "confidence", "error"] + \
+              [f"top{i}_{field}" for i in range(1, k + 1) for field in ("class", "probability")]
+    start = time.time()
+    scored = failed = 0
+
+    with open(output, "a", newline="") as out, \
+            ThreadPoolExecutor(max_workers=workers or os.cpu_count(), thread_name_prefix="decode") as pool:
+        writer = csv.DictWriter(out, columns) if fmt == "csv" else None
+        if writer is not None and out.tell() == 0:
+            writer.writeheader()
+
+        def write(path, prediction=None, error=None):
+            if fmt == "jsonl":
+                out.write(json.dumps({"path": path, **(prediction or {}), "error": error}) + "\n")
+                return
+            row = {"path": path, "error": error or ""}
+            if prediction:
+                row.update({"class": prediction["class"], "confidence": prediction["confidence"]})
+                for i, entry in enumerate(prediction["top_k"], 1):
+                    row.update({f"top{i}_class": entry["class"], f"top{i}_probability": entry["probability"]})
+            writer.writerow(row)
+
+        pending = collections.deque()
+        next_path = iter(paths)
+
+        def refill():
+            while len(pending) < batch_size * prefetch_batches:
+                path = next(next_path, None)
+                if path is None:
+                    return
+                pending.append((path, pool.submit(_read_and_decode, path, inference.img_size)))
+
+        refill()
+        while pending:
+            batch_paths, images = [], []
+            while pending and len(images) < batch_size:
+                path, future = pending.popleft()
+                image, error = future.result()
+                if error is not None:
+                    write(path, error=error)
+                    failed += 1
+                else:
+                    batch_paths.append(path)
+                    images.append(image)
+            refill()  # keep the workers decoding while this batch runs
+            if images:
+                predictions = inference.classify(np.stack(images).astype(np.float32) / 255.0)
+                for path, prediction in zip(batch_paths, predictions):
+                    write(path, prediction)
+                scored += len(images)
+            out.flush()
+
+    elapsed = time.time() - start
+    report = {'output': output, 'scored': scored, 'failed': failed, 'skipped': len(done),
+              'seconds': elapsed, 'images_per_sec': scored / elapsed if elapsed else 0.0}
+    logger.info(f"Scored {scored} images ({failed} unreadable) in {elapsed:.1f}s "
+                f"({report['images_per_sec']:.1f} images/s)")
+    return report
@@ -0,0 +1,664 @@
+import os
+import json
+import time
+import bisect
+import asyncio
+import hashlib
+import hmac
+import logging
+import threading
+import collections
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+# The API server: configuration, batching, caching, metrics and the FastAPI routes. It imports
+# only model.py (JAX/Flax, NumPy, Pillow) and FastAPI; run it with `uvicorn serving:app`.
+import jax
+from fastapi import FastAPI, File, UploadFile, HTTPException, Header
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response
+from PIL import Image
+
+from model import (BATCH_BUCKETS, DATA_PATH, compilation_cache_stats, enable_compilation_cache,
+                   load_inference_artifact, open_image, resize_image, sniff_image)
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# ------------------------------
+# Prometheus-style Metrics
+# ------------------------------
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        METRICS.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _label_str(self, key, extra=()):
+        pairs = list(zip(self.labelnames, key)) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{self._label_str(key)} {value}")
+        return lines
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=(.001, .0025, .005, .01, .025, .05,
+                                                                   .1, .25, .5, 1, 2.5, 5, 10)):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.name}_bucket{self._label_str(key, [('le', le)])} {cumulative}")
+            lines.append(f"{self.name}_sum{self._label_str(key)} {total}")
+            lines.append(f"{self.name}_count{self._label_str(key)} {cumulative}")
+        return lines
+
+METRICS = []
+STAGE_SECONDS = Histogram("agrivision_stage_seconds", "Time spent per request-path stage",
+                          ["stage"])
+REQUEST_SECONDS = Histogram("agrivision_request_seconds", "End-to-end request latency", ["endpoint"])
+REQUESTS_IN_FLIGHT = Gauge("agrivision_requests_in_flight", "Prediction requests currently admitted")
+BATCH_SIZE = Histogram("agrivision_batch_size", "Images per forward pass",
+                       buckets=(1, 2, 4, 8, 16, 32, 64))
+JIT_COMPILATIONS = Counter("agrivision_jit_compilations_total", "XLA backend compilations in this process")
+ERRORS = Counter("agrivision_errors_total", "Failed prediction requests by error type", ["type"])
+PREDICTION_CACHE = Counter("agrivision_prediction_cache_total", "Prediction cache lookups", ["result"])
+MODEL_RELOADS = Counter("agrivision_model_reloads_total", "Model hot-swap attempts", ["result"])
+PREDICTION_CACHE_BYTES = Gauge("agrivision_prediction_cache_bytes", "Approximate size of cached predictions")
+
+def render_metrics():
+    return "\n".join(line for metric in METRICS for line in metric.render()) + "\n"
+
+def _count_compilation(event, duration, **kwargs):
+    if event == "/jax/core/compile/backend_compile_duration":
+        JIT_COMPILATIONS.inc()
+
+jax.monitoring.register_event_duration_secs_listener(_count_compilation)
+
+# ------------------------------
+# Prediction Cache
+# ------------------------------
+class PredictionCache:
+    """Size- and TTL-bounded LRU of predictions keyed by (model version, upload hash); event loop only."""
+    def __init__(self, max_bytes, ttl_s=3600.0):
+        self.max_bytes = max_bytes
+        self.ttl_s = ttl_s
+        self.entries = collections.OrderedDict()  # key -> (expires_at, size, prediction)
+        self.size = 0
+
+    @staticmethod
+    def key(data, version):
+        return version, hashlib.blake2b(data, digest_size=16).digest()
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] < time.monotonic():
+            self._evict(key)
+            entry = None
+        if entry is None:
+            PREDICTION_CACHE.inc(result="miss")
+            return None
+        self.entries.move_to_end(key)
+        PREDICTION_CACHE.inc(result="hit")
+        return entry[2]
+
+    def put(self, key, prediction):
+        size = len(json.dumps(prediction)) + 64  # key and bookkeeping overhead
+        if size > self.max_bytes:
+            return
+        if key in self.entries:
+            self._evict(key)
+        self.entries[key] = (time.monotonic() + self.ttl_s, size, prediction)
+        self.size += size
+        while self.size > self.max_bytes:
+            self._evict(next(iter(self.entries)))
+        PREDICTION_CACHE_BYTES.set(self.size)
+
+    def _evict(self, key):
+        self.size -= self.entries.pop(key)[1]
+        PREDICTION_CACHE_BYTES.set(self.size)
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+        PREDICTION_CACHE_BYTES.set(0)
+
+# ------------------------------
+# Dynamic Micro-Batching
+# ------------------------------
+class MicroBatcher:
+    """Collects concurrent requests into one forward pass on the model each was admitted under."""
+    def __init__(self, inference, max_batch_size=32, max_wait_ms=5.0, executor=None):
+        self.inference = inference
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.executor = executor
+        self.queue = None
+        self._worker = None
+        self._running = set()  # futures of the batch currently on the executor
+
+    async def start(self):
+        self.queue = asyncio.Queue()
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    async def submit(self, image, model=None):
+        """Queue one preprocessed (img_size, img_size, 3) image and wait for its prediction."""
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((image, future, time.perf_counter(), model or self.inference))
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            if future in self._running:  # already computing: finish before releasing the caller
+                await asyncio.wait([future])
+            future.cancel()
+            raise
+
+    async def _get_live(self):
+        """Next queued item whose caller is still waiting."""
+        while True:
+            item = await self.queue.get()
+            if not item[1].done():
+                return item
+
+    async def _collect(self):
+        batch = [await self._get_live()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            if not self.queue.empty():
+                item = self.queue.get_nowait()
+                if not item[1].done():
+                    batch.append(item)
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._get_live(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            dispatched = time.perf_counter()
+            by_model = {}
+            for item in batch:
+                STAGE_SECONDS.observe(dispatched - item[2], stage="queue_wait")
+                by_model.setdefault(id(item[3]), []).append(item)
+            for items in by_model.values():
+                await self._dispatch(items)
+
+    async def _dispatch(self, batch):
+        batch = [item for item in batch if not item[1].done()]  # cancelled while batching
+        if not batch:
+            return
+        BATCH_SIZE.observe(len(batch))
+        images = np.stack([item[0] for item in batch])
+        futures = {item[1] for item in batch}
+        self._running |= futures
+        try:
+            predictions = await asyncio.get_running_loop().run_in_executor(
+                self.executor, self._classify, batch[0][3], images)
+        except Exception as e:
+            for item in batch:
+                if not item[1].done():
+                    item[1].set_exception(e)
+            return
+        finally:
+            self._running -= futures
+        for item, prediction in zip(batch, predictions):
+            if not item[1].done():
+                item[1].set_result(prediction)
+
+    def _classify(self, model, images):
+        start = time.perf_counter()
+        predictions = model.classify(images)
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage="compute")
+        return predictions
+
+app = FastAPI()
+
+# Enable CORS (Cross-Origin Resource Sharing)
+origins = [
+    "http://localhost:5173",  # Your React app's development URL
+    "http://localhost:8000", # Your backend url
+    # Add other origins if needed (e.g., productionURL)
+]
+
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=origins,
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
+# The inference artifact is produced by running main.py as a script (training). The server
+# only ever loads it; it never scans the dataset or trains.
+MODEL_PATH = os.environ.get("AGRIVISION_MODEL_PATH", os.path.join(DATA_PATH, "final_model.flax"))
+
+# Serving configuration, read from the environment so it can be tuned per deployment.
+# Requests arriving within MAX_BATCH_WAIT_MS of each other share one forward pass.
+MAX_BATCH_SIZE = int(os.environ.get("AGRIVISION_MAX_BATCH_SIZE", BATCH_BUCKETS[-1]))
+MAX_BATCH_WAIT_MS = float(os.environ.get("AGRIVISION_MAX_BATCH_WAIT_MS", 5.0))
+# Decode and forward passes run on this many worker threads, never on the event loop.
+INFERENCE_WORKERS = int(os.environ.get("AGRIVISION_INFERENCE_WORKERS", min(4, os.cpu_count() or 1)))
+# Images admitted but not yet answered; beyond this new work is rejected with 503.
+MAX_PENDING_IMAGES = int(os.environ.get("AGRIVISION_MAX_PENDING_IMAGES", 256))
+REQUEST_TIMEOUT_S = float(os.environ.get("AGRIVISION_REQUEST_TIMEOUT_S", 30.0))
+# Compute precision override ('float32' or 'bfloat16'); defaults to the artifact's own.
+SERVING_PRECISION = os.environ.get("AGRIVISION_PRECISION")
+# Optional on-disk XLA cache so restarted workers skip compiling the serving buckets.
+COMPILATION_CACHE_DIR = os.environ.get("AGRIVISION_COMPILATION_CACHE_DIR")
+# Cache predictions for repeated uploads of identical bytes (0 disables).
+PREDICTION_CACHE_MB = float(os.environ.get("AGRIVISION_PREDICTION_CACHE_MB", 0))
+PREDICTION_CACHE_TTL_S = float(os.environ.get("AGRIVISION_PREDICTION_CACHE_TTL_S", 3600))
+# Uploads larger than this are rejected with 413 (streamed, never fully buffered).
+MAX_UPLOAD_BYTES = int(float(os.environ.get("AGRIVISION_MAX_UPLOAD_MB", 20)) * 2**20)
+# Header-declared dimensions beyond this are rejected with 422 before decoding.
+MAX_IMAGE_PIXELS = int(float(os.environ.get("AGRIVISION_MAX_IMAGE_MEGAPIXELS", 50)) * 10**6)
+UPLOAD_FORMATS = set(os.environ.get("AGRIVISION_UPLOAD_FORMATS", "JPEG,MPO,PNG,WEBP,BMP").split(","))
+UPLOAD_CHUNK_BYTES = 256 * 2**10
+# Uploads larger than this are hashed for the prediction cache on the worker pool, not the event loop.
+INLINE_HASH_BYTES = 256 * 2**10
+# Poll MODEL_PATH this often and hot-swap when it changes (0 disables the watcher).
+MODEL_WATCH_INTERVAL_S = float(os.environ.get("AGRIVISION_MODEL_WATCH_INTERVAL_S", 0))
+# Required in the X-Admin-Token header of /admin/ requests; unset disables them.
+ADMIN_TOKEN = os.environ.get("AGRIVISION_ADMIN_TOKEN")
+
+executor = ThreadPoolExecutor(max_workers=INFERENCE_WORKERS, thread_name_prefix="inference")
+inference = None
+batcher = None
+pending_images = 0
+prediction_cache = PredictionCache(int(PREDICTION_CACHE_MB * 2**20), PREDICTION_CACHE_TTL_S) \
+    if PREDICTION_CACHE_MB > 0 else None
+model_info = {}
+reload_lock = asyncio.Lock()
+watcher = None
+rejected_stamp = None  # (path, mtime_ns, size) of the last artifact the watcher failed to load
+
+def _artifact_stamp(path):
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+def _prepare_model(path, expected_classes=None):
+    """Load, validate and compile an artifact without touching the serving model."""
+    model = load_inference_artifact(path, precision=SERVING_PRECISION)
+    _validate_and_warm(model, path, expected_classes)
+    return model
+
+def _validate_and_warm(model, path, expected_classes=None):
+    classes = list(model.class_names)
+    if not classes or len(set(classes)) != len(classes):
+        raise ValueError(f"{path} has an empty or duplicated class list")
+    if expected_classes is not None and classes != list(expected_classes):
+        raise ValueError(f"{path} classes {classes} differ from the serving classes {list(expected_classes)}")
+    # Compile every serving bucket now so the first requests don't pay for it.
+    model.warmup(MAX_BATCH_SIZE)
+    probs, _ = model.predict_batch(np.zeros((1, model.img_size, model.img_size, 3), np.float32))
+    if not np.all(np.isfinite(probs)):
+        raise ValueError(f"{path} produces non-finite probabilities")
+
+def _activate(model, path, stamp, load_s):
+    """Swap ``model`` in: requests admitted from now on use it, queued ones keep theirs."""
+    global inference
+    inference = model
+    batcher.inference = model
+    if prediction_cache is not None:
+        prediction_cache.clear()
+    model_info.update({'version': model.version, 'path': os.path.abspath(path), 'mtime_ns': stamp[0],
+                       'size_bytes': stamp[1], 'loaded_at': time.strftime("%Y-%m-%dT%H:%M:%S"),
+                       'load_s': round(load_s, 3)})
+
+@app.on_event("startup")
+async def load_model():
+    global inference, batcher, watcher
+    if not os.path.exists(MODEL_PATH):
+        raise RuntimeError(f"Inference artifact not found at {MODEL_PATH}; "
+                           "train one first with `python src/main.py`")
+    start = time.time()
+    stamp = _artifact_stamp(MODEL_PATH)
+    inference = load_inference_artifact(MODEL_PATH, precision=SERVING_PRECISION)
+    if COMPILATION_CACHE_DIR:
+        enable_compilation_cache(COMPILATION_CACHE_DIR, model="FastVisionModel", **inference.model_config,
+                                 img_size=inference.img_size, top_k=inference.top_k, buckets=BATCH_BUCKETS)
+    _validate_and_warm(inference, MODEL_PATH)
+    if COMPILATION_CACHE_DIR:
+        stats = compilation_cache_stats()
+        logger.info(f"Compilation cache: {stats['hits']} hits, {stats['misses']} misses")
+    batcher = MicroBatcher(inference, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_BATCH_WAIT_MS,
+                           executor=executor)
+    await batcher.start()
+    _activate(inference, MODEL_PATH, stamp, time.time() - start)
+    if MODEL_WATCH_INTERVAL_S > 0:
+        watcher = asyncio.create_task(_watch_model())
+    logger.info(f"Model {inference.version} loaded and warmed up in {time.time() - start:.2f}s "
+                f"({len(inference.class_names)} classes).")
+
+async def reload_model(path=None, allow_class_change=False):
+    """Load and warm ``path`` (default MODEL_PATH) in the background, then hot-swap it in."""
+    path = path or MODEL_PATH
+    async with reload_lock:
+        start = time.time()
+        try:
+            stamp = _artifact_stamp(path)
+            expected = None if allow_class_change else inference.class_names
+            model = await asyncio.get_running_loop().run_in_executor(None, _prepare_model, path, expected)
+        except Exception as e:
+            MODEL_RELOADS.inc(result="failed")
+            logger.error(f"Model reload from {path} failed, keeping {inference.version}: {e}")
+            raise
+        previous = inference.version
+        _activate(model, path, stamp, time.time() - start)
+        MODEL_RELOADS.inc(result="success")
+        logger.info(f"Model {previous} replaced by {model.version} in {time.time() - start:.2f}s")
+        return dict(model_info)
+
+async def _watch_model():
+    global rejected_stamp
+    while True:
+        await asyncio.sleep(MODEL_WATCH_INTERVAL_S)
+        try:
+            stamp = (os.path.abspath(MODEL_PATH), *_artifact_stamp(MODEL_PATH))
+        except OSError:
+            continue
+        active = (model_info.get('path'), model_info.get('mtime_ns'), model_info.get('size_bytes'))
+        if stamp != active and stamp != rejected_stamp:
+            try:
+                await reload_model(MODEL_PATH)
+            except Exception:
+                # Don't retry the same broken file every interval.
+                rejected_stamp = stamp
+
+@app.on_event("shutdown")
+async def stop_batcher():
+    if watcher is not None:
+        watcher.cancel()
+    if batcher is not None:
+        await batcher.stop()
+    executor.shutdown(wait=False)
+
+def _reject(status_code, error_type, detail):
+    ERRORS.inc(type=error_type)
+    raise HTTPException(status_code=status_code, detail=detail)
+
+class RequestSizeLimit:
+    """ASGI middleware: 413 for /predict bodies over the limit, counted as they stream in."""
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith("/predict"):
+            return await self.app(scope, receive, send)
+        files = MAX_BATCH_SIZE if scope["path"].startswith("/predict/batch") else 1
+        limit = files * MAX_UPLOAD_BYTES + 64 * 2**10  # + multipart framing
+        declared = dict(scope["headers"]).get(b"content-length", b"")
+        if declared.isdigit() and int(declared) > limit:
+            return await self._reject(scope, receive, send)
+        received = 0
+        rejected = started = False
+
+        async def counting_receive():
+            nonlocal received, rejected
+            if rejected:
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit and not started:
+                    # Answer now and make the multipart parser stop as if the client had left;
+                    # whatever the app sends afterwards is dropped.
+                    rejected = True
+                    await self._reject(scope, receive, send)
+                    return {"type": "http.disconnect"}
+            return message
+
+        async def guarded_send(message):
+            nonlocal started
+            if rejected:
+                return
+            started = True
+            await send(message)
+
+        await self.app(scope, counting_receive, guarded_send)
+
+    @staticmethod
+    async def _reject(scope, receive, send):
+        ERRORS.inc(type="too_large")
+        await JSONResponse({"detail": "Upload too large"}, status_code=413)(scope, receive, send)
+
+app.add_middleware(RequestSizeLimit)
+
+async def _read_upload(file):
+    """Read an upload in chunks, giving up as soon as it exceeds MAX_UPLOAD_BYTES."""
+    data = bytearray()
+    while True:
+        chunk = await file.read(UPLOAD_CHUNK_BYTES)
+        if not chunk:
+            return data
+        if len(data) + len(chunk) > MAX_UPLOAD_BYTES:
+            _reject(413, "too_large", f"Upload exceeds {MAX_UPLOAD_BYTES // 2**20} MB")
+        data += chunk
+
+def _sniff_upload(data):
+    """Validate format and dimensions from the image header alone."""
+    try:
+        image = sniff_image(data)
+    except (Image.UnidentifiedImageError, Image.DecompressionBombError):
+        _reject(415, "unsupported_media", "Not a recognized image")
+    if image.format not in UPLOAD_FORMATS:
+        _reject(415, "unsupported_media", f"Unsupported image format {image.format}")
+    width, height = image.size
+    if not width or not height or width * height > MAX_IMAGE_PIXELS:
+        _reject(422, "invalid_image", f"Image dimensions {width}x{height} out of range")
+    return image
+
+def _preprocess_upload(model, data):
+    start = time.perf_counter()
+    image = _sniff_upload(data)
+    try:
+        image = open_image(image, model.img_size)
+    except OSError as e:  # truncated or corrupt pixel data
+        _reject(422, "invalid_image", f"Image could not be decoded: {e}")
+    decoded = time.perf_counter()
+    batch = model.preprocess_array(resize_image(image, model.img_size))
+    STAGE_SECONDS.observe(decoded - start, stage="decode")
+    STAGE_SECONDS.observe(time.perf_counter() - decoded, stage="resize_normalize")
+    return batch
+
+async def _run_on_executor(fn, *args):
+    """``run_in_executor`` whose cancellation drops a job not yet started and waits out a running one."""
+    job = executor.submit(fn, *args)
+    try:
+        return await asyncio.wrap_future(job)
+    except asyncio.CancelledError:
+        if not job.cancel():
+            await asyncio.wait([asyncio.wrap_future(job)])
+        raise
+
+async def _predict_upload(file):
+    # Read the upload and decode it straight from memory on the worker pool (no temp file).
+    # The model is pinned here so a concurrent hot swap can't mix two models in one request.
+    model = inference
+    start = time.perf_counter()
+    image_data = await _read_upload(file)
+    STAGE_SECONDS.observe(time.perf_counter() - start, stage="upload_read")
+    if prediction_cache is not None:
+        if len(image_data) <= INLINE_HASH_BYTES:
+            key = prediction_cache.key(image_data, model.version)
+        else:
+            key = await _run_on_executor(prediction_cache.key, image_data, model.version)
+        prediction = prediction_cache.get(key)
+        if prediction is not None:
+            return prediction
+    image = await _run_on_executor(_preprocess_upload, model, image_data)
+    prediction = await batcher.submit(image[0], model)
+    if prediction_cache is not None:
+        prediction_cache.put(key, prediction)
+    return prediction
+
+def _json_response(content):
+    start = time.perf_counter()
+    response = JSONResponse(content)
+    STAGE_SECONDS.observe(time.perf_counter() - start, stage="serialize")
+    return response
+
+async def _admit(num_images, work):
+    """Await ``work()`` if there is room for ``num_images`` more images, within the request timeout."""
+    global pending_images
+    if num_images > MAX_PENDING_IMAGES:
+        _reject(413, "too_many_images", f"At most {MAX_PENDING_IMAGES} images per request")
+    if pending_images + num_images > MAX_PENDING_IMAGES:
+        ERRORS.inc(type="busy")
+        raise HTTPException(status_code=503, detail="Server busy, retry later",
+                            headers={"Retry-After": "1"})
+    pending_images += num_images
+    task = asyncio.ensure_future(work())
+
+    def release(task):
+        global pending_images
+        pending_images -= num_images
+        if not task.cancelled():
+            task.exception()  # retrieved here when the caller has already given up
+
+    task.add_done_callback(release)
+    REQUESTS_IN_FLIGHT.inc()
+    try:
+        return await asyncio.wait_for(asyncio.shield(task), timeout=REQUEST_TIMEOUT_S)
+    except asyncio.TimeoutError:
+        ERRORS.inc(type="timeout")
+        raise HTTPException(status_code=504, detail="Prediction timed out")
+    finally:
+        task.cancel()  # no-op once finished; also covers a disconnected client
+        REQUESTS_IN_FLIGHT.dec()
+
+@app.post("/predict/")
+async def predict(file: UploadFile = File(...)):
+    start = time.perf_counter()
+    try:
+        return _json_response(await _admit(1, lambda: _predict_upload(file)))
+    except HTTPException:
+        raise
+    except Exception as e:
+        ERRORS.inc(type=type(e).__name__)
+        logger.error(f"Error during prediction: {e}")
+        raise HTTPException(status_code=500, detail="Prediction failed")
+    finally:
+        REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint="/predict/")
+
+@app.post("/predict/batch")
+async def predict_batch(files: List[UploadFile] = File(...)):
+    async def predict_all():
+        # On the first failure cancel the siblings and wait for them, so none outlives the request's
+        # admission slots and none leaves an unretrieved exception behind.
+        tasks = [asyncio.ensure_future(_predict_upload(file)) for file in files]
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        for task in done:
+            if task.exception() is not None:
+                raise task.exception()
+        return [task.result() for task in tasks]
+    start = time.perf_counter()
+    try:
+        predictions = await _admit(len(files), predict_all)
+        return _json_response({"predictions": list(predictions)})
+    except HTTPException:
+        raise
+    except Exception as e:
+        ERRORS.inc(type=type(e).__name__)
+        logger.error(f"Error during batch prediction: {e}")
+        raise HTTPException(status_code=500, detail="Prediction failed")
+    finally:
+        REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint="/predict/batch")
+
+@app.get("/metrics")
+async def metrics():
+    return Response(render_metrics(), media_type="text/plain; version=0.0.4")
+
+@app.get("/classes/")
+async def get_classes():
+    return {"classes": inference.class_names}
+
+@app.get("/model/")
+async def get_model():
+    return {**model_info, "classes": len(inference.class_names), "img_size": inference.img_size,
+            "model_config": inference.model_config}
+
+@app.post("/admin/reload")
+async def admin_reload(allow_class_change: bool = False, x_admin_token: str = Header(None)):
+    """Hot-swap MODEL_PATH; the current model keeps serving until the new one is warm."""
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Admin endpoints are disabled")
+    if not hmac.compare_digest((x_admin_token or "").encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+    try:
+        return await reload_model(MODEL_PATH, allow_class_change=allow_class_change)
+    except Exception as e:
+        raise HTTPException(status_code=422, detail=f"Reload failed, previous model still active: {e}")